@@ -0,0 +1,61 @@
+import calendar
+
+import numpy as np
+
+nSlots = 366
+
+# Day-of-year slots follow a leap-year calendar, so a given month-day has the same slot
+# in every year. Feb 29 is slot 59 and only holds data for leap years and climatologies.
+monthStarts = np.array([0, 31, 60, 91, 121, 152, 182, 213, 244, 274, 305, 335])
+slotMonths = np.repeat(np.arange(1, 13), np.diff(np.append(monthStarts, nSlots)))
+slotDays = np.arange(nSlots) - monthStarts[slotMonths - 1] + 1
+leapDaySlot = 59
+
+# How a series without Feb 29 stands in for it when compared with one that has it:
+#   'drop'        leave the slot empty, so Feb 29 only appears when both sides have it
+#   'feb28'       reuse that series' Feb 28 value
+#   'interpolate' use the mean of that series' Feb 28 and Mar 1
+leapDayPolicies = ('drop', 'feb28', 'interpolate')
+defaultLeapDayPolicy = 'drop'
+
+
+def slotsOf(months, days):
+    return monthStarts[np.asarray(months) - 1] + np.asarray(days) - 1
+
+
+def dateSlots(dates):
+    return slotsOf(dates.month, dates.day)
+
+
+def hasLeapDay(year):
+    # year is None for climatologies such as the 1991-2020 normals, which include Feb 29
+    return year is None or calendar.isleap(year)
+
+
+def validSlots(year):
+    valid = np.ones(nSlots, dtype=bool)
+    if not hasLeapDay(year):
+        valid[leapDaySlot] = False
+    return valid
+
+
+def fillLeapDay(values, year, policy=defaultLeapDayPolicy):
+    if policy not in leapDayPolicies:
+        raise ValueError(f"Unknown leap-day policy {policy!r}, expected one of {leapDayPolicies}")
+    if hasLeapDay(year) or policy == 'drop':
+        return values
+    out = np.array(values, copy=True)
+    if policy == 'feb28':
+        out[leapDaySlot] = values[leapDaySlot - 1]
+    else:
+        out[leapDaySlot] = (values[leapDaySlot - 1] + values[leapDaySlot + 1]) / 2
+    return out
+
+
+def alignedDifference(values, year, otherValues, otherYear, policy=defaultLeapDayPolicy):
+    # values - otherValues slot by slot, laid out on the calendar of the first operand:
+    # a common first year never has Feb 29, a leap one gets it from the policy if the other side lacks it
+    diff = values - fillLeapDay(otherValues, otherYear, policy)
+    if not hasLeapDay(year):
+        diff = np.where(validSlots(year), diff, np.nan).astype(diff.dtype)
+    return diff
@@ -0,0 +1,145 @@
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import re
+import sys
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pipeline
+from alignment import defaultLeapDayPolicy, leapDayPolicies
+from noaa_cache import defaultCachePath
+from upstream import UpstreamError
+
+# A manifest is a JSON list of blocks; each block renders every combination of its
+# modes x stations x years x metrics. A station entry is one ID or, for the two-station
+# modes, a list of IDs; a year entry is one year or, for Two Years and Year Range, a pair:
+#
+#   [{"modes": ["Single Station", "Anomaly"], "stations": ["USW00023169"],
+#     "years": [2023, 2024], "metrics": ["Maximum temperature"]},
+#    {"modes": ["Two Stations"], "stations": [["USW00023169", "USW00023174"]],
+#     "years": [2024], "metrics": ["Precipitation"]},
+#    {"modes": ["Percentile"], "stations": ["USW00023169"], "years": [2024],
+#     "metrics": ["Maximum temperature"], "baseline": [1991, 2020]},
+#    {"modes": ["Normals Single Station"], "stations": ["USW00023169"], "metrics": ["Average Temperature"]}]
+#
+# Percentile ranks against the whole period of record when a block has no baseline.
+
+Job = namedtuple('Job', 'mode sids years metric leapDay baseline')
+
+
+def asList(value):
+    return list(value) if isinstance(value, (list, tuple)) else [value]
+
+
+def expandManifest(manifest):
+    jobs = []
+    for block in manifest:
+        leapDay = block.get('leapDay', defaultLeapDayPolicy)
+        baseline = tuple(block['baseline']) if block.get('baseline') else None
+        if leapDay not in leapDayPolicies:
+            raise ValueError(f"Unknown leap-day policy {leapDay!r}, expected one of {leapDayPolicies}")
+        for mode in block['modes']:
+            if mode not in pipeline.viewModes:
+                raise ValueError(f"Unknown mode {mode!r}, expected one of {list(pipeline.viewModes)}")
+            for metric in block['metrics']:
+                if metric not in pipeline.viewMetrics[mode]:
+                    raise ValueError(f"{mode} cannot show {metric!r}, expected one of {pipeline.viewMetrics[mode]}")
+            # The Normals modes have no year, so a block's years do not multiply them
+            yearEntries = [()] if pipeline.viewModes[mode][1] is None else [tuple(asList(y)) for y in block['years']]
+            for stations, years, metric in itertools.product(block['stations'], yearEntries, block['metrics']):
+                jobs.append(Job(mode, tuple(s.strip().upper() for s in asList(stations)), years, metric, leapDay, baseline))
+    return list(dict.fromkeys(jobs))
+
+
+def slug(text):
+    return re.sub(r'[^a-z0-9]+', '-', str(text).lower()).strip('-')
+
+
+def outputPath(outDir, job):
+    parts = ['_'.join(job.sids)]
+    if job.years:
+        parts.append('-'.join(map(str, job.years)))
+    parts.append(slug(job.metric))
+    if job.mode == 'Single Station (Two Years)' and job.leapDay != defaultLeapDayPolicy:
+        parts.append(job.leapDay)
+    if job.mode == 'Percentile':
+        parts.append('vs-' + ('-'.join(map(str, job.baseline)) if job.baseline else 'record'))
+    return os.path.join(outDir, slug(job.mode), '_'.join(parts) + '.png')
+
+
+def initWorker(cachePath, upstreamSlots):
+    # Every worker shares the SQLite data cache and the cap on requests in flight
+    pipeline.configure(cachePath=cachePath, upstreamSlots=upstreamSlots)
+
+
+def renderJobs(jobs, outDir, skipExisting):
+    # One batch of jobs on the same stations, so their data is fetched once and reused from memory
+    results = []
+    for job in jobs:
+        path = outputPath(outDir, job)
+        if skipExisting and os.path.exists(path):
+            results.append((job, path, 'skipped', None))
+            continue
+        started = time.perf_counter()
+        try:
+            png = pipeline.renderPng(pipeline.buildView(job.mode, job.sids, job.years, job.metric, job.leapDay, job.baseline))
+        except (pipeline.ViewError, UpstreamError) as e:
+            results.append((job, path, 'failed', str(e)))
+            continue
+        except Exception as e:
+            results.append((job, path, 'failed', f"{type(e).__name__}: {e}"))
+            continue
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write then rename so a reader never picks up a half-written image
+        tmpPath = f"{path}.tmp"
+        with open(tmpPath, 'wb') as f:
+            f.write(png)
+        os.replace(tmpPath, path)
+        results.append((job, path, 'rendered', round((time.perf_counter() - started) * 1000)))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render calendar PNGs for every station, year, metric and mode in a manifest.")
+    parser.add_argument('manifest', help="JSON manifest of stations x years x metrics x modes")
+    parser.add_argument('--out', default='calendars', help="Directory for the rendered PNGs")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="Rendering processes")
+    parser.add_argument('--max-requests', type=int, default=6, help="Upstream requests in flight across all workers")
+    parser.add_argument('--cache', default=defaultCachePath, help="SQLite data cache shared by the workers")
+    parser.add_argument('--skip-existing', action='store_true', help="Leave PNGs that are already rendered")
+    args = parser.parse_args()
+
+    with open(args.manifest) as f:
+        jobs = expandManifest(json.load(f))
+    groups = {}
+    for job in jobs:
+        groups.setdefault(job.sids, []).append(job)
+
+    ctx = multiprocessing.get_context()
+    upstreamSlots = ctx.BoundedSemaphore(args.max_requests)
+    started = time.perf_counter()
+    counts = {'rendered': 0, 'skipped': 0, 'failed': 0}
+    with ProcessPoolExecutor(max_workers=args.workers, mp_context=ctx,
+                             initializer=initWorker, initargs=(args.cache, upstreamSlots)) as pool:
+        futures = [pool.submit(renderJobs, group, args.out, args.skip_existing) for group in groups.values()]
+        for future in as_completed(futures):
+            for job, path, status, detail in future.result():
+                counts[status] += 1
+                if status == 'failed':
+                    print(f"failed  {job.mode} {','.join(job.sids)} {job.years} {job.metric}: {detail}", file=sys.stderr)
+                elif status == 'rendered':
+                    print(f"{detail:>6} ms  {path}")
+
+    elapsed = time.perf_counter() - started
+    print(f"{counts['rendered']} rendered, {counts['skipped']} skipped, {counts['failed']} failed "
+          f"of {len(jobs)} in {elapsed:.1f}s", file=sys.stderr)
+    if counts['failed']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
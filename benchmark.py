@@ -0,0 +1,478 @@
+import argparse
+import csv
+import hashlib
+import io
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qsl
+
+import numpy as np
+import pandas as pd
+
+here = os.path.dirname(os.path.abspath(__file__))
+appPath = os.path.join(here, 'Calendar_Heatmap.py')
+defaultFixtureDir = os.path.join(here, 'bench_fixtures')
+defaultBaselinePath = os.path.join(here, 'bench_baseline.json')
+
+# Live endpoints the stand-in servers replace, and the env vars pipeline.py reads them from
+upstreams = {
+    'ncei': ('NCEI_BASE_URL', 'https://www.ncei.noaa.gov'),
+    'acis': ('ACIS_BASE_URL', 'http://data.rcc-acis.org'),
+    'nominatim': ('NOMINATIM_BASE_URL', 'https://nominatim.openstreetmap.org'),
+}
+recordHeaders = {
+    'ncei': {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'},
+    'acis': {'Content-Type': 'application/json'},
+    'nominatim': {'User-Agent': 'StreamlitWeatherApp/1.0'},
+}
+
+station1 = 'USW00023169'
+station2 = 'USW00023174'
+benchYear = 2023
+percentiles = (50, 95, 99)
+
+
+# ---- Stand-in upstream servers ----
+
+def fixtureName(service, method, path, body):
+    # Query parameters are sorted so the same request always maps to the same recording
+    parts = urlsplit(path)
+    query = '&'.join(f"{k}={v}" for k, v in sorted(parse_qsl(parts.query)))
+    digest = hashlib.sha1(f"{method} {parts.path}?{query}".encode() + b'\n' + body).hexdigest()[:16]
+    return f"{service}-{digest}"
+
+
+def synthesizeNcei(path):
+    # Same columns, quoting and value ranges as NCEI, seeded by station so runs are reproducible
+    q = dict(parse_qsl(urlsplit(path).query))
+    frames = []
+    for sid in q['stations'].split(','):
+        rng = np.random.default_rng(zlib.crc32(sid.encode()))
+        name = f"{sid} STAND-IN STATION, NV US"
+        if q['dataset'].startswith('normals'):
+            dates = pd.date_range('2010-01-01', '2010-12-31')
+            season = np.sin((dates.dayofyear.to_numpy() - 105) / 58.1)
+            frames.append(pd.DataFrame({
+                'STATION': sid, 'DATE': dates.strftime('%m-%d'), 'NAME': name,
+                'DLY-TMAX-NORMAL': np.round(78 + 22 * season, 1),
+                'DLY-TMIN-NORMAL': np.round(55 + 20 * season, 1),
+                'DLY-TAVG-NORMAL': np.round(66 + 21 * season, 1),
+            }))
+        else:
+            dates = pd.date_range(q['startDate'], q['endDate'])
+            n = len(dates)
+            season = np.sin((dates.dayofyear.to_numpy() - 105) / 58.1)
+            tmax = np.round(78 + 22 * season + rng.normal(0, 5, n))
+            frames.append(pd.DataFrame({
+                'STATION': sid, 'DATE': dates.strftime('%Y-%m-%d'), 'NAME': name,
+                'AWND': np.round(rng.uniform(2, 15, n), 2),
+                'PRCP': np.round(np.where(rng.random(n) < 0.1, rng.exponential(0.3, n), 0), 2),
+                'SNOW': 0.0,
+                'TMAX': tmax.astype(int),
+                'TMIN': (tmax - rng.integers(15, 30, n)).astype(int),
+                'WSF2': rng.integers(10, 40, n).astype(float),
+                'WSF5': rng.integers(15, 50, n).astype(float),
+            }))
+    out = io.StringIO()
+    pd.concat(frames).to_csv(out, index=False, quoting=csv.QUOTE_ALL)
+    return out.getvalue().encode()
+
+
+def synthesizeAcis(body):
+    minLon, minLat, maxLon, maxLat = json.loads(body)['bbox']
+    meta = [{'name': f"STAND-IN STATION {i}", 'sids': [f"USC00{i:06d} 6", f"{i:04d} 2"]} for i in range(40)]
+    meta.append({'name': 'STAND-IN AIRPORT', 'sids': [f"{station1} 6", "LAS 3"]})
+    return json.dumps({'meta': meta, 'bbox': [minLon, minLat, maxLon, maxLat]}).encode()
+
+
+def synthesizeNominatim(path):
+    return json.dumps([{'boundingbox': ['35.9', '36.4', '-115.4', '-114.9'], 'display_name': dict(parse_qsl(urlsplit(path).query)).get('q', '')}]).encode()
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    # Replays a recorded response when there is one, records it live with --record,
+    # and otherwise answers with synthetic data in the upstream's format
+    service = None
+    fixtureDir = defaultFixtureDir
+    record = False
+    latency = 0.0
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.respond(b'')
+
+    def do_POST(self):
+        self.respond(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+
+    def respond(self, body):
+        path = os.path.join(self.fixtureDir, fixtureName(self.service, self.command, self.path, body))
+        status = 200
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                data = f.read()
+        elif self.record:
+            status, data = self.recordLive(body, path)
+        elif self.service == 'ncei':
+            data = synthesizeNcei(self.path)
+        elif self.service == 'acis':
+            data = synthesizeAcis(body)
+        else:
+            data = synthesizeNominatim(self.path)
+        if self.latency:
+            time.sleep(self.latency)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json' if self.service != 'ncei' else 'text/csv')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def recordLive(self, body, path):
+        import requests
+        url = upstreams[self.service][1] + self.path
+        r = requests.request(self.command, url, data=body or None, headers=recordHeaders[self.service], timeout=120)
+        if r.status_code == 200:
+            os.makedirs(self.fixtureDir, exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(r.content)
+        return r.status_code, r.content
+
+
+def startStandIns(fixtureDir=defaultFixtureDir, record=False, latency=0.0):
+    # One server per upstream, so the per-host limits in the app apply to each service separately
+    servers = {}
+    for service in upstreams:
+        handler = type(f"{service}Handler", (StandInHandler,),
+                       {'service': service, 'fixtureDir': fixtureDir, 'record': record, 'latency': latency})
+        server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers[service] = server
+    return servers
+
+
+# ---- Scenarios, driven through Streamlit's headless AppTest ----
+
+def selectIdSearch(at):
+    for key in ['smhist1', 'smhist2', 'smclim1', 'smclim2']:
+        try:
+            at.radio(key=key).set_value('ID')
+        except KeyError:
+            pass
+    at.run()
+
+
+def historical(mode, yearKey, extra=None):
+    def setup(at):
+        at.selectbox(key='histMode').set_value(mode).run()
+        selectIdSearch(at)
+        at.text_input(key='txthist1').set_value(station1)
+        if mode == 'Single Station (Two Years)':
+            at.selectbox(key='hy1').set_value(benchYear)
+            at.selectbox(key='hy2').set_value(benchYear - 9)
+        else:
+            at.selectbox(key=yearKey).set_value(benchYear)
+        if extra:
+            extra(at)
+        at.run()
+        return [b for b in at.button if b.label == 'Generate Calendar'][0]
+    return setup
+
+
+def normals(at):
+    selectIdSearch(at)
+    at.text_input(key='txtclim1').set_value(station1).run()
+    return [b for b in at.button if b.label == 'Generate Normals Calendar'][0]
+
+
+def stationSearch(at):
+    at.text_input(key='cityhist1').set_value('Las Vegas').run()
+    return at.button(key='btnhist1')
+
+
+scenarios = {
+    'Single Station': historical('Single Station', 'hy1_single'),
+    'Two Years': historical('Single Station (Two Years)', None),
+    'Two Stations': historical('Two Stations', 'hy1_single', lambda at: at.text_input(key='txthist2').set_value(station2)),
+    'Anomaly': historical('Anomaly', 'hy1_anom'),
+    'Percentile': historical('Percentile', 'hy1_pct'),
+    'Normals': normals,
+    'Station Search': stationSearch,
+}
+
+
+class SpanCollector(logging.Handler):
+    # Gathers the JSON span lines the app logs, tagged with the scenario being measured.
+    # logging.Handler.handle already serialises emit() under the handler's own lock.
+    def __init__(self):
+        super().__init__(logging.INFO)
+        self.scenario = None
+        self.records = []
+
+    def emit(self, record):
+        self.records.append((self.scenario, json.loads(record.getMessage())))
+
+
+def prepare(setup, renderer):
+    # Widget setup is not timed; only the run triggered by the button is
+    from streamlit.testing.v1 import AppTest
+    at = AppTest.from_file(appPath, default_timeout=300)
+    at.run()
+    at.radio(key='renderer').set_value(renderer)
+    return at, setup(at)
+
+
+def click(at, button):
+    started = time.perf_counter()
+    button.click().run()
+    elapsed = time.perf_counter() - started
+    problems = [e.value for e in at.error] + [e.value for e in at.exception]
+    if problems:
+        raise RuntimeError(f"Scenario failed: {problems}")
+    return elapsed
+
+
+def clearCaches(cacheDir):
+    # Cold start for every measured round: no memoised data, no rendered PNGs, no disk cache
+    import streamlit as st
+    import pipeline
+    st.cache_data.clear()
+    st.cache_resource.clear()
+    pipeline.resetCaches()
+    for name in os.listdir(cacheDir):
+        os.remove(os.path.join(cacheDir, name))
+
+
+def summarize(values):
+    values = np.asarray(values) * 1000
+    out = {f"p{p}": round(float(np.percentile(values, p)), 2) for p in percentiles}
+    out['n'] = len(values)
+    return out
+
+
+def runScenario(name, setup, iterations, sessions, rounds, warm, renderer, cacheDir, collector):
+    collector.scenario = name
+    single = []
+    for _ in range(iterations):
+        if not warm:
+            clearCaches(cacheDir)
+        single.append(click(*prepare(setup, renderer)))
+
+    # N simulated sessions issue the same request at once, as after a shared link goes around
+    concurrent = []
+    wall = 0.0
+    for _ in range(rounds):
+        if not warm:
+            clearCaches(cacheDir)
+        # Sessions are set up one at a time (AppTest's widget setup is not thread-safe), then all click at once
+        prepared = [prepare(setup, renderer) for _ in range(sessions)]
+        results = [None] * sessions
+        def worker(i):
+            results[i] = click(*prepared[i])
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(sessions)]
+        started = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        wall += time.perf_counter() - started
+        if any(r is None for r in results):
+            raise RuntimeError(f"{name}: a concurrent session failed")
+        concurrent.extend(results)
+
+    stages = {}
+    for scenario, span in collector.records:
+        if scenario == name:
+            stages.setdefault(span['stage'], []).append(span['ms'] / 1000)
+    return {
+        'single': summarize(single),
+        'concurrent': dict(summarize(concurrent), sessions=sessions,
+                           throughput=round(len(concurrent) / wall, 3) if wall else None),
+        'stages': {stage: summarize(vals) for stage, vals in stages.items()},
+    }
+
+
+# ---- Cold start, each run in a fresh interpreter so nothing is imported or built yet ----
+
+# Times importing the pipeline, the app's first script run, and a string of PNG renders of one
+# view: the first pays for matplotlib and the figure template, the rest show the steady state.
+# The data is fetched from the stand-ins before any render is timed.
+startupProbe = r"""
+import json, sys, time
+started = time.perf_counter()
+import pipeline
+imported = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+appStarted = time.perf_counter()
+AppTest.from_file(sys.argv[1], default_timeout=300).run()
+appRun = time.perf_counter() - appStarted
+view = pipeline.buildView('Single Station', [sys.argv[2]], [int(sys.argv[3])], 'Maximum temperature')
+renders = []
+for _ in range(int(sys.argv[4])):
+    renderStarted = time.perf_counter()
+    pipeline.renderPng(view)
+    renders.append(time.perf_counter() - renderStarted)
+print(json.dumps({'import': imported - started, 'appStart': appRun, 'firstRender': renders[0], 'render': renders[1:]}))
+"""
+
+
+def runStartup(iterations, renders):
+    samples = {'import': [], 'appStart': [], 'firstRender': [], 'render': []}
+    for _ in range(iterations):
+        out = subprocess.run([sys.executable, '-c', startupProbe, appPath, station1, str(benchYear), str(renders + 1)],
+                             cwd=here, capture_output=True, text=True, check=True)
+        result = json.loads(out.stdout.strip().splitlines()[-1])
+        for name in ('import', 'appStart', 'firstRender'):
+            samples[name].append(result[name])
+        samples['render'].extend(result['render'])
+    return {name: summarize(values) for name, values in samples.items()}
+
+
+def compareToBaseline(report, baseline, tolerance):
+    # Latencies may grow and throughput may shrink by at most `tolerance` before it counts as a regression
+    regressions = []
+    rows = []
+    for name, result in report['scenarios'].items():
+        base = baseline.get('scenarios', {}).get(name)
+        if base is None:
+            continue
+        checks = [(f"single {p}", result['single'][p], base['single'][p], False) for p in ('p50', 'p95', 'p99')]
+        checks += [(f"concurrent {p}", result['concurrent'][p], base['concurrent'][p], False) for p in ('p50', 'p95', 'p99')]
+        checks.append(('throughput', result['concurrent']['throughput'], base['concurrent']['throughput'], True))
+        for metric, now, then, higherIsBetter in checks:
+            if not now or not then:
+                continue
+            ratio = now / then
+            worse = ratio < 1 / (1 + tolerance) if higherIsBetter else ratio > 1 + tolerance
+            rows.append((name, metric, then, now, ratio, 'REGRESSION' if worse else ''))
+            if worse:
+                regressions.append(f"{name} {metric}: {then} -> {now}")
+    for metric, result in report.get('startup', {}).items():
+        base = baseline.get('startup', {}).get(metric)
+        if base is None:
+            continue
+        for p in ('p50', 'p95'):
+            ratio = result[p] / base[p]
+            worse = ratio > 1 + tolerance
+            rows.append(('startup', f"{metric} {p}", base[p], result[p], ratio, 'REGRESSION' if worse else ''))
+            if worse:
+                regressions.append(f"startup {metric} {p}: {base[p]} -> {result[p]}")
+    return rows, regressions
+
+
+def printReport(report, comparison):
+    print(f"\n{'scenario':<16}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}   "
+          f"{'N-session p50':>14}{'p95':>10}{'p99':>10}{'runs/s':>9}")
+    for name, result in report['scenarios'].items():
+        s, c = result['single'], result['concurrent']
+        print(f"{name:<16}{s['p50']:>10}{s['p95']:>10}{s['p99']:>10}   "
+              f"{c['p50']:>14}{c['p95']:>10}{c['p99']:>10}{c['throughput']:>9}")
+    print("\nper-stage p50 / p95 ms (all runs)")
+    for name, result in report['scenarios'].items():
+        stages = ', '.join(f"{stage} {v['p50']}/{v['p95']}" for stage, v in result['stages'].items())
+        print(f"  {name:<16}{stages}")
+    if 'startup' in report:
+        print(f"\n{'cold start':<16}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'n':>6}")
+        for metric, v in report['startup'].items():
+            print(f"{metric:<16}{v['p50']:>10}{v['p95']:>10}{v['p99']:>10}{v['n']:>6}")
+    if comparison:
+        print(f"\n{'scenario':<16}{'metric':<18}{'baseline':>10}{'now':>10}{'ratio':>8}")
+        for name, metric, then, now, ratio, flag in comparison:
+            print(f"{name:<16}{metric:<18}{then:>10}{now:>10}{ratio:>8.2f}  {flag}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the calendar pipeline against local stand-ins for NCEI, ACIS and Nominatim.")
+    parser.add_argument('--scenario', action='append', choices=list(scenarios), help="Run only these scenarios (repeatable)")
+    parser.add_argument('--iterations', type=int, default=5, help="Single-session runs per scenario")
+    parser.add_argument('--sessions', type=int, default=4, help="Concurrent simulated sessions")
+    parser.add_argument('--rounds', type=int, default=2, help="Concurrent rounds per scenario")
+    parser.add_argument('--latency', type=float, default=0.0, help="Seconds of simulated upstream latency per response")
+    parser.add_argument('--warm', action='store_true', help="Keep caches between runs instead of starting cold")
+    parser.add_argument('--renderer', choices=['Interactive', 'Image'], default='Interactive', help="Calendar style to generate")
+    parser.add_argument('--startup', action='store_true', help="Also time cold start and repeated PNG renders in fresh interpreters")
+    parser.add_argument('--renders', type=int, default=5, help="PNG renders after the first in each cold-start run")
+    parser.add_argument('--fixtures', default=defaultFixtureDir, help="Directory of recorded upstream responses")
+    parser.add_argument('--record', action='store_true', help="Fetch missing responses from the live services and save them")
+    parser.add_argument('--baseline', default=defaultBaselinePath, help="Baseline report to compare against")
+    parser.add_argument('--save-baseline', action='store_true', help="Write this run's report as the new baseline")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="Allowed relative slowdown before a metric is a regression")
+    parser.add_argument('--output', help="Also write the JSON report here")
+    parser.add_argument('--serve', action='store_true', help="Only run the stand-in servers, e.g. for `streamlit run`")
+    args = parser.parse_args()
+
+    servers = startStandIns(args.fixtures, args.record, args.latency)
+    for service, server in servers.items():
+        os.environ[upstreams[service][0]] = f"http://127.0.0.1:{server.server_address[1]}"
+    if args.serve:
+        for service in upstreams:
+            print(f"{upstreams[service][0]}={os.environ[upstreams[service][0]]}")
+        threading.Event().wait()
+
+    # Everything the app persists goes to a throwaway directory; an empty station index
+    # directory keeps station search on the remote Nominatim + ACIS path
+    workDir = tempfile.mkdtemp(prefix='calendar_bench_')
+    cacheDir = os.path.join(workDir, 'cache')
+    os.makedirs(cacheDir)
+    os.environ['NOAA_CACHE_PATH'] = os.path.join(cacheDir, 'noaa.sqlite3')
+    os.environ['STATION_INDEX_DIR'] = os.path.join(workDir, 'no-index')
+    os.environ['SPAN_LOG'] = '0'
+    sys.path.insert(0, here)
+
+    collector = SpanCollector()
+    spanLogger = logging.getLogger('calendar_heatmaps.spans')
+    spanLogger.setLevel(logging.INFO)
+    spanLogger.addHandler(collector)
+    logging.getLogger('streamlit').setLevel(logging.ERROR)
+
+    report = {
+        'config': {'iterations': args.iterations, 'sessions': args.sessions, 'rounds': args.rounds,
+                   'latency': args.latency, 'warm': args.warm, 'renderer': args.renderer,
+                   'startup': args.startup},
+        'scenarios': {},
+    }
+    try:
+        for name in args.scenario or list(scenarios):
+            print(f"running {name}...", file=sys.stderr)
+            report['scenarios'][name] = runScenario(name, scenarios[name], args.iterations, args.sessions,
+                                                    args.rounds, args.warm, args.renderer, cacheDir, collector)
+        if args.startup:
+            print("running cold start...", file=sys.stderr)
+            report['startup'] = runStartup(args.iterations, args.renders)
+    finally:
+        shutil.rmtree(workDir, ignore_errors=True)
+
+    comparison, regressions = [], []
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get('config') != report['config']:
+            print("warning: baseline was recorded with different settings", file=sys.stderr)
+        comparison, regressions = compareToBaseline(report, baseline, args.tolerance)
+    printReport(report, comparison)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nbaseline written to {args.baseline}")
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) beyond {args.tolerance:.0%}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
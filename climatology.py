@@ -0,0 +1,123 @@
+import json
+import struct
+
+import numpy as np
+
+from alignment import nSlots
+
+_magic = b'CLM1'
+defaultMinYears = 5
+
+
+class Climatology:
+    # One metric for one station over its period of record: values[i, slot] is the value for
+    # years[i] on that day-of-year slot, NaN where missing. Every statistic below is computed
+    # over a baseline window of years in one vectorized pass, so any window is cheap.
+    __slots__ = ('sid', 'name', 'metric', 'years', 'values')
+
+    def __init__(self, sid, name, metric, years, values):
+        years = np.asarray(years, dtype=np.int16)
+        values = np.asarray(values, dtype=np.float32)
+        if values.shape != (len(years), nSlots):
+            raise ValueError(f"Climatology needs {len(years)}x{nSlots} values, got {values.shape}")
+        if values.flags.writeable:
+            values = values.copy()
+            values.flags.writeable = False
+        self.sid = sid
+        self.name = name
+        self.metric = metric
+        self.years = years
+        self.values = values
+
+    @classmethod
+    def fromSeries(cls, sid, name, metric, seriesList):
+        # Years with no data at either end are trimmed, so the matrix starts at the first observation
+        rows = [(s.year, s.values) for s in seriesList]
+        have = [i for i, (_, values) in enumerate(rows) if not np.isnan(values).all()]
+        rows = rows[have[0]:have[-1] + 1] if have else []
+        values = np.stack([values for _, values in rows]) if rows else np.empty((0, nSlots), dtype=np.float32)
+        return cls(sid, name, metric, [year for year, _ in rows], values)
+
+    @property
+    def empty(self):
+        return not len(self.years)
+
+    def coverage(self, startYear=None, endYear=None):
+        # The years a window actually covers, for labels
+        inside = self.years[self._rows(startYear, endYear)]
+        return (int(inside[0]), int(inside[-1])) if len(inside) else (startYear, endYear)
+
+    def _rows(self, startYear=None, endYear=None, exclude=None):
+        rows = np.ones(len(self.years), dtype=bool)
+        if startYear is not None:
+            rows &= self.years >= startYear
+        if endYear is not None:
+            rows &= self.years <= endYear
+        if exclude is not None:
+            rows &= self.years != exclude
+        return rows
+
+    def baseline(self, startYear=None, endYear=None, exclude=None):
+        return self.values[self._rows(startYear, endYear, exclude)]
+
+    def counts(self, startYear=None, endYear=None, exclude=None):
+        return (~np.isnan(self.baseline(startYear, endYear, exclude))).sum(axis=0)
+
+    def normals(self, startYear=None, endYear=None, exclude=None, minYears=defaultMinYears):
+        base = self.baseline(startYear, endYear, exclude)
+        valid = ~np.isnan(base)
+        count = valid.sum(axis=0)
+        total = np.where(valid, base, 0).sum(axis=0, dtype=np.float64)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            out = total / count
+        out[count < minYears] = np.nan
+        return out.astype(np.float32)
+
+    def percentileRanks(self, values, startYear=None, endYear=None, exclude=None, minYears=defaultMinYears):
+        # Mid-rank percentile of each day's value among the baseline years for that day:
+        # 0 is below every baseline year, 100 above every one, ties count half
+        base = self.baseline(startYear, endYear, exclude)
+        values = np.asarray(values, dtype=np.float32)
+        count = (~np.isnan(base)).sum(axis=0)
+        below = (base < values).sum(axis=0)
+        equal = (base == values).sum(axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            ranks = 100 * (below + 0.5 * equal) / count
+        ranks[(count < minYears) | np.isnan(values)] = np.nan
+        return ranks.astype(np.float32)
+
+    def recordHighs(self, startYear=None, endYear=None, exclude=None):
+        return self._records(np.fmax, startYear, endYear, exclude)
+
+    def recordLows(self, startYear=None, endYear=None, exclude=None):
+        return self._records(np.fmin, startYear, endYear, exclude)
+
+    def _records(self, pick, startYear, endYear, exclude):
+        # (values, years): the record for each slot and the latest year that set it, 0 where there is none
+        rows = self._rows(startYear, endYear, exclude)
+        base = self.values[rows]
+        records = pick.reduce(base, axis=0, initial=np.nan)
+        hit = (base == records) & ~np.isnan(base)
+        years = np.where(hit, self.years[rows][:, None], 0).max(axis=0, initial=0)
+        return records, years
+
+    def toBytes(self):
+        # Same layout as StationSeries: small JSON header, then the raw little-endian float32 matrix
+        header = json.dumps([self.sid, self.name, self.metric, self.years.tolist()]).encode('utf-8')
+        header += b' ' * (-(len(_magic) + 4 + len(header)) % 4)
+        return b''.join([_magic, struct.pack('<I', len(header)), header,
+                         memoryview(np.ascontiguousarray(self.values, dtype='<f4')).cast('B')])
+
+    @classmethod
+    def fromBytes(cls, buf):
+        buf = memoryview(buf)
+        if bytes(buf[:4]) != _magic:
+            raise ValueError("Not a serialized Climatology")
+        (headerLen,) = struct.unpack('<I', buf[4:8])
+        sid, name, metric, years = json.loads(bytes(buf[8:8 + headerLen]))
+        values = np.frombuffer(buf, dtype='<f4', count=len(years) * nSlots, offset=8 + headerLen)
+        return cls(sid, name, metric, years, values.reshape(len(years), nSlots))
+
+    def __repr__(self):
+        first, last = self.coverage()
+        return f"Climatology({self.sid!r}, {self.name!r}, {self.metric!r}, {first}-{last})"
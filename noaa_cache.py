@@ -0,0 +1,127 @@
+import os
+import sqlite3
+import time
+import zlib
+from contextlib import closing
+from datetime import datetime
+
+defaultCachePath = os.environ.get(
+    'NOAA_CACHE_PATH',
+    os.path.join(os.path.expanduser('~'), '.cache', 'calendar_heatmaps', 'noaa.sqlite3')
+)
+defaultMaxBytes = int(os.environ.get('NOAA_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+defaultCurrentYearTtl = int(os.environ.get('NOAA_CACHE_CURRENT_YEAR_TTL', 6 * 60 * 60))
+
+
+class StationYearCache:
+    # Durable cache of NCEI responses keyed by (station, dataset, year).
+    # SQLite handles locking, so one file can be shared by every session and worker process.
+    def __init__(self, path=defaultCachePath, maxBytes=defaultMaxBytes, currentYearTtl=defaultCurrentYearTtl):
+        self.path = path
+        self.maxBytes = maxBytes
+        self.currentYearTtl = currentYearTtl
+        dirName = os.path.dirname(path)
+        if dirName:
+            os.makedirs(dirName, exist_ok=True)
+        with closing(self._connect()) as conn, conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS station_year ('
+                ' sid TEXT NOT NULL,'
+                ' dataset TEXT NOT NULL,'
+                ' year INTEGER NOT NULL,'
+                ' fetched_at REAL NOT NULL,'
+                ' last_access REAL NOT NULL,'
+                ' final INTEGER NOT NULL,'
+                ' nbytes INTEGER NOT NULL,'
+                ' payload BLOB NOT NULL,'
+                ' last_date TEXT,'
+                ' PRIMARY KEY (sid, dataset, year))'
+            )
+            # Files written before last_date existed get the column added in place
+            columns = [row[1] for row in conn.execute('PRAGMA table_info(station_year)')]
+            if 'last_date' not in columns:
+                conn.execute('ALTER TABLE station_year ADD COLUMN last_date TEXT')
+            conn.execute('CREATE INDEX IF NOT EXISTS station_year_lru ON station_year (last_access)')
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def get(self, sid, dataset, year):
+        now = time.time()
+        try:
+            with closing(self._connect()) as conn, conn:
+                row = conn.execute(
+                    'SELECT fetched_at, final, payload FROM station_year WHERE sid = ? AND dataset = ? AND year = ?',
+                    (sid, dataset, year)
+                ).fetchone()
+                if row is None:
+                    return None
+                fetchedAt, final, payload = row
+                # Completed years never expire; a year still in progress is only good for the TTL
+                if not final and now - fetchedAt > self.currentYearTtl:
+                    return None
+                conn.execute(
+                    'UPDATE station_year SET last_access = ? WHERE sid = ? AND dataset = ? AND year = ?',
+                    (now, sid, dataset, year)
+                )
+            return zlib.decompress(payload)
+        except (sqlite3.Error, zlib.error):
+            return None
+
+    def has(self, sid, dataset, year):
+        # Whether get() would return an entry, without reading or touching it
+        try:
+            with closing(self._connect()) as conn:
+                row = conn.execute(
+                    'SELECT fetched_at, final FROM station_year WHERE sid = ? AND dataset = ? AND year = ?',
+                    (sid, dataset, year)
+                ).fetchone()
+        except sqlite3.Error:
+            return False
+        return row is not None and (bool(row[1]) or time.time() - row[0] <= self.currentYearTtl)
+
+    def getStale(self, sid, dataset, year):
+        # A year still in progress whose TTL has run out, as (data, lastDate), so the caller
+        # can fetch just the days after lastDate; None when there is nothing to build on
+        try:
+            with closing(self._connect()) as conn:
+                row = conn.execute(
+                    'SELECT final, payload, last_date FROM station_year WHERE sid = ? AND dataset = ? AND year = ?',
+                    (sid, dataset, year)
+                ).fetchone()
+            if row is None or row[0] or row[2] is None:
+                return None
+            return zlib.decompress(row[1]), row[2]
+        except (sqlite3.Error, zlib.error):
+            return None
+
+    def put(self, sid, dataset, year, data, lastDate=None):
+        # lastDate is the last day with data in this payload, as YYYY-MM-DD
+        now = time.time()
+        final = now >= datetime(year + 1, 1, 1).timestamp()
+        payload = zlib.compress(data)
+        try:
+            with closing(self._connect()) as conn, conn:
+                conn.execute(
+                    'INSERT OR REPLACE INTO station_year'
+                    ' (sid, dataset, year, fetched_at, last_access, final, nbytes, payload, last_date)'
+                    ' VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (sid, dataset, year, now, now, int(final), len(payload), payload, lastDate)
+                )
+                self._evict(conn)
+        except sqlite3.Error:
+            pass
+
+    def _evict(self, conn):
+        total = conn.execute('SELECT COALESCE(SUM(nbytes), 0) FROM station_year').fetchone()[0]
+        if total <= self.maxBytes:
+            return
+        rows = conn.execute('SELECT rowid, nbytes FROM station_year ORDER BY last_access').fetchall()
+        doomed = []
+        for rowid, nbytes in rows:
+            if total <= self.maxBytes:
+                break
+            doomed.append((rowid,))
+            total -= nbytes
+        conn.executemany('DELETE FROM station_year WHERE rowid = ?', doomed)
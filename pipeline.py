@@ -0,0 +1,985 @@
+import calendar
+import csv
+import functools
+import io
+import os
+import struct
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from urllib.parse import urlsplit
+
+import numpy as np
+import pandas as pd
+
+from noaa_cache import StationYearCache, defaultCachePath
+from station_series import StationSeries, packSeries, unpackSeries
+from climatology import Climatology
+from alignment import slotMonths, slotDays, validSlots, defaultLeapDayPolicy
+from upstream import UpstreamClient, UpstreamError
+from timing import span, bound
+
+# Fetch, align, color and render, with no Streamlit in sight. The app and batch_render.py
+# both sit on top of this module.
+
+# Overridable so benchmark.py can point the pipeline at its local stand-in servers
+nceiBaseUrl = os.environ.get('NCEI_BASE_URL', 'https://www.ncei.noaa.gov')
+acisBaseUrl = os.environ.get('ACIS_BASE_URL', 'http://data.rcc-acis.org')
+nominatimBaseUrl = os.environ.get('NOMINATIM_BASE_URL', 'https://nominatim.openstreetmap.org')
+
+dailyDataTypes = 'TMAX,TMIN,TAVG,PRCP,SNOW,AWND,WSF2,WSF5'
+normalsDataTypes = 'DLY-TMAX-NORMAL,DLY-TMIN-NORMAL,DLY-TAVG-NORMAL'
+maxBatchStations = 12
+maxRangeYears = 30
+normalsDisplayYear = 2020
+# A refresh of the running year starts this many days before the last stored observation,
+# so values NCEI revises after quality control are picked up too
+refreshOverlapDays = int(os.environ.get('NOAA_REFRESH_OVERLAP_DAYS', 7))
+# Period-of-record pulls start here; years before a station opened come back empty and are trimmed
+climatologyFirstYear = int(os.environ.get('CLIMATOLOGY_FIRST_YEAR', 1900))
+
+noaaHeaders = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+}
+
+_settings = {'cachePath': defaultCachePath, 'upstreamSlots': None}
+
+
+class NoaaFetchError(UpstreamError):
+    pass
+
+
+class ViewError(Exception):
+    # A view that cannot be drawn, with a message fit to show the user
+    pass
+
+
+# ---- Shared resources ----
+
+def configure(cachePath=None, upstreamSlots=None):
+    # Called by each batch worker before anything is fetched. upstreamSlots is a
+    # multiprocessing semaphore that caps requests in flight across every worker.
+    if cachePath:
+        _settings['cachePath'] = cachePath
+    _settings['upstreamSlots'] = upstreamSlots
+    resetCaches()
+
+
+@functools.lru_cache(maxsize=None)
+def getStationCache():
+    return StationYearCache(_settings['cachePath'])
+
+
+@functools.lru_cache(maxsize=None)
+def getUpstreamClient():
+    # Nominatim's usage policy allows one request at a time
+    return UpstreamClient(hostLimits={
+        urlsplit(nceiBaseUrl).netloc: 6,
+        urlsplit(acisBaseUrl).netloc: 4,
+        urlsplit(nominatimBaseUrl).netloc: 1,
+    }, sharedSlots=_settings['upstreamSlots'])
+
+
+def resetCaches():
+    # Drops every in-memory result and shared resource; the disk cache itself is left alone
+    for fn in (fetchStationYear, fetchStationsYear, fetchStationYears, fetchClimatology, getStationCache, getUpstreamClient):
+        fn.cache_clear()
+
+
+# ---- NCEI requests and parsing ----
+
+def buildNoaaUrl(sids, dataset, reqStart, reqEnd, dataTypes):
+    return (
+        f"{nceiBaseUrl}/access/services/data/v1"
+        f"?dataset={dataset}"
+        f"&stations={','.join(sids)}"
+        f"&startDate={reqStart}"
+        f"&endDate={reqEnd}"
+        f"&dataTypes={dataTypes}"
+        f"&units=standard"
+        f"&format=csv"
+        f"&includeStationName=true"
+    )
+
+def requestNoaaCsv(url):
+    # An HTML error page is recognised from its first bytes instead of lowercasing the whole response
+    try:
+        with span('ncei') as s:
+            body = getUpstreamClient().fetch(url, headers=noaaHeaders, checkHead=checkHtmlBody)
+            s.set(bytes=len(body))
+            return body
+    except NoaaFetchError:
+        raise
+    except UpstreamError as e:
+        raise NoaaFetchError(f"NOAA API Error: Status {e.status}" if e.status else f"NOAA API Error: {e}") from e
+
+def checkHtmlBody(head):
+    head = head.lstrip().lower()
+    if head.startswith(b'<!doctype') or head.startswith(b'<html'):
+        raise NoaaFetchError("NOAA API Error: Status 200 with an HTML page instead of CSV")
+
+def splitCsv(body, keys, keyOf):
+    # Cuts a response into per-key CSV bodies without parsing it, so each piece
+    # can be cached exactly like a single station-year response
+    lines = body.splitlines(keepends=True)
+    if not lines:
+        return {key: b"" for key in keys}
+    header = lines[0]
+    parts = {key: [header] for key in keys}
+    for line in lines[1:]:
+        key = keyOf(line)
+        if key in parts:
+            parts[key].append(line)
+    return {key: b"".join(p) for key, p in parts.items()}
+
+def splitCsvByStation(body, sids):
+    return splitCsv(body, sids, lambda line: line.split(b',', 1)[0].strip(b'"').decode('ascii'))
+
+def splitCsvByYear(body, years):
+    # DATE is the second column and starts with the year
+    return splitCsv(body, years, lambda line: int(line.split(b',', 2)[1].strip(b'"')[:4]))
+
+def readCsvRow(body, start):
+    end = body.find(b'\n', start)
+    line = body[start:] if end < 0 else body[start:end + 1]
+    return next(csv.reader([line.decode('utf-8')]), []), (len(body) if end < 0 else end + 1)
+
+def cleanStationName(rawName):
+    if rawName.endswith(' US'):
+        rawName = rawName[:-3]
+    elif rawName.endswith(', US'):
+        rawName = rawName[:-4]
+    name = rawName.title()
+    if ',' in name:
+        parts = name.rsplit(',', 1)
+        if len(parts) == 2:
+            mainPart = parts[0]
+            statePart = parts[1].strip()
+            if len(statePart) == 2:
+                name = f"{mainPart}, {statePart.upper()}"
+    return name
+
+def parseStationCsv(body, sid, isClimate=False):
+    with span('parse', sid=sid, bytes=len(body), rows=max(body.count(b'\n') - 1, 0)):
+        return parseStationCsvBody(body, sid, isClimate)
+
+def parseStationCsvBody(body, sid, isClimate=False):
+    columns, dataStart = readCsvRow(body, 0)
+    if 'DATE' not in columns or dataStart >= len(body):
+        return {}, sid
+
+    # Only DATE and the value columns are parsed, with their dtypes given up front
+    dataTypes = normalsDataTypes if isClimate else dailyDataTypes
+    valueCols = [c for c in dataTypes.split(',') if c in columns]
+    schema = {col: 'float32' for col in valueCols}
+    schema['DATE'] = str
+    try:
+        df = pd.read_csv(io.BytesIO(body), usecols=['DATE'] + valueCols, dtype=schema)
+    except ValueError:
+        # A stray non-numeric token; coerce it to NaN like the rest of the missing values
+        df = pd.read_csv(io.BytesIO(body), usecols=['DATE'] + valueCols, dtype={'DATE': str})
+        for col in valueCols:
+            df[col] = pd.to_numeric(df[col], errors='coerce').astype('float32')
+
+    if df.empty:
+        return {}, sid
+
+    # The station name repeats on every row, so it is read from the first one only
+    stationName = sid
+    if 'NAME' in columns:
+        firstRow, _ = readCsvRow(body, dataStart)
+        if len(firstRow) == len(columns) and firstRow[columns.index('NAME')]:
+            stationName = cleanStationName(firstRow[columns.index('NAME')])
+
+    dates = pd.to_datetime("2020-" + df['DATE'] if isClimate else df['DATE'], format='%Y-%m-%d').dt
+    year = None if isClimate else int(dates.year.iloc[0])
+    wide = {col: StationSeries.fromDates(sid, stationName, year, col, dates, df[col].to_numpy())
+            for col in valueCols}
+
+    return wide, stationName
+
+
+# ---- Station-year data ----
+# Each of these raises NoaaFetchError instead of returning an empty result, so a failed
+# request is never memoised; the parsed results are shared by every caller in the process.
+# epoch is only part of the memo key: see refreshEpoch.
+
+def refreshEpoch(year):
+    # Completed years are memoised for good; the running year once per disk-cache TTL,
+    # after which the next lookup finds its disk entry stale and refreshes it
+    if year is None or year < datetime.now().year:
+        return None
+    ttl = getStationCache().currentYearTtl
+    if ttl <= 0:
+        # A TTL of zero means the running year is never reused, in memory or on disk
+        return time.time_ns()
+    return int(time.time() // ttl)
+
+def csvLastDate(body):
+    # NCEI returns each station's rows in date order, so the last row holds the latest date
+    lines = body.rstrip(b'\r\n').split(b'\n')
+    if len(lines) < 2:
+        return None
+    return lines[-1].split(b',', 2)[1].strip(b'"').decode('ascii')[:10]
+
+def mergeCsv(stored, fresh, since):
+    # The stored rows dated before since, then every row of fresh, which covers since onwards
+    freshLines = fresh.splitlines(keepends=True)
+    if len(freshLines) < 2:
+        return stored
+    storedLines = stored.splitlines(keepends=True)
+    sinceBytes = since.encode('ascii')
+    kept = [line if line.endswith(b'\n') else line + b'\n'
+            for line in storedLines[1:] if line.split(b',', 2)[1].strip(b'"') < sinceBytes]
+    if storedLines[0].rstrip(b'\r\n') == freshLines[0].rstrip(b'\r\n'):
+        return b''.join([storedLines[0]] + kept + freshLines[1:])
+
+    # NCEI only lists the columns a response has data for, so a short window can come back
+    # with a different header; then both sets of rows are rewritten under the union of the two
+    storedReader = csv.DictReader(io.StringIO(b''.join([storedLines[0]] + kept).decode('utf-8')))
+    freshReader = csv.DictReader(io.StringIO(fresh.decode('utf-8')))
+    storedRows, freshRows = list(storedReader), list(freshReader)
+    columns = list(dict.fromkeys(storedReader.fieldnames + freshReader.fieldnames))
+    out = io.StringIO()
+    writer = csv.DictWriter(out, columns, restval='', quoting=csv.QUOTE_ALL, lineterminator='\n')
+    writer.writeheader()
+    writer.writerows(storedRows + freshRows)
+    return out.getvalue().encode('utf-8')
+
+def refreshStationYears(sids, year):
+    # Brings stale entries for a year in progress up to date by fetching only the trailing
+    # window since the stations' last observation. Returns {sid: body} for the ones refreshed.
+    dataset = 'daily-summaries'
+    cache = getStationCache()
+    stale = {}
+    for sid in dict.fromkeys(sids):
+        entry = cache.getStale(sid, dataset, year)
+        if entry is not None:
+            stale[sid] = entry
+    if not stale:
+        return {}
+
+    lastDate = min(date.fromisoformat(entryDate) for _, entryDate in stale.values())
+    since = max(lastDate - timedelta(days=refreshOverlapDays), date(year, 1, 1)).isoformat()
+    until = min(date.today(), date(year, 12, 31)).isoformat()
+    refreshed = {}
+    if since > until:
+        # Nothing can have been observed since; the stored copies just start a new TTL
+        for sid, (body, entryDate) in stale.items():
+            cache.put(sid, dataset, year, body, entryDate)
+            refreshed[sid] = body
+        return refreshed
+    with span('refresh', stations=len(stale), since=since) as s:
+        staleSids = list(stale)
+        for i in range(0, len(staleSids), maxBatchStations):
+            batch = staleSids[i:i + maxBatchStations]
+            url = buildNoaaUrl(batch, dataset, since, until, dailyDataTypes)
+            for sid, fresh in splitCsvByStation(requestNoaaCsv(url), batch).items():
+                body = mergeCsv(stale[sid][0], fresh, since)
+                cache.put(sid, dataset, year, body, csvLastDate(body))
+                refreshed[sid] = body
+                s.add('rows', max(fresh.count(b'\n') - 1, 0))
+    return refreshed
+
+def loadParsed(cache, sid, dataset, year):
+    # The station-year's parsed columns, stored next to its CSV so a memo miss skips pandas;
+    # they are views into the cached payload. None when they are not on disk.
+    payload = cache.get(sid, f"parsed {dataset}", year)
+    if payload is None:
+        return None
+    try:
+        seriesList = unpackSeries(payload)
+    except (ValueError, struct.error):
+        return None
+    return {series.metric: series for series in seriesList}, (seriesList[0].name if seriesList else sid)
+
+def parseAndStore(cache, sid, dataset, year, body, isClimate=False):
+    # The CSV stays on disk as well, since a refresh of the running year merges new rows into it
+    wide, stationName = parseStationCsv(body, sid, isClimate)
+    cache.put(sid, f"parsed {dataset}", year, packSeries(wide.values()))
+    return wide, stationName
+
+@functools.lru_cache(maxsize=512)
+def fetchStationYear(sid, year, isClimate=False, epoch=None):
+    if isClimate:
+        dataset = 'normals-daily-1991-2020'
+        reqStart = "2010-01-01"
+        reqEnd = "2010-12-31"
+        dataTypes = normalsDataTypes
+    else:
+        dataset = 'daily-summaries'
+        reqStart = f"{year}-01-01"
+        reqEnd = f"{year}-12-31"
+        dataTypes = dailyDataTypes
+
+    cache = getStationCache()
+    cacheYear = int(reqStart[:4])
+    with span('disk', sid=sid) as s:
+        parsed = loadParsed(cache, sid, dataset, cacheYear)
+        body = None if parsed is not None else cache.get(sid, dataset, cacheYear)
+        s.set(cache='parsed' if parsed is not None else 'miss' if body is None else 'hit',
+              bytes=0 if body is None else len(body))
+    if parsed is not None:
+        return parsed
+    if body is None and not isClimate:
+        body = refreshStationYears([sid], year).get(sid)
+    if body is None:
+        body = requestNoaaCsv(buildNoaaUrl([sid], dataset, reqStart, reqEnd, dataTypes))
+        cache.put(sid, dataset, cacheYear, body, None if isClimate else csvLastDate(body))
+
+    return parseAndStore(cache, sid, dataset, cacheYear, body, isClimate)
+
+@functools.lru_cache(maxsize=128)
+def fetchStationsYear(sids, year, epoch=None):
+    # One NCEI request for every station in sids that is not already on disk
+    dataset = 'daily-summaries'
+    cache = getStationCache()
+    results = {}
+    bodies = {}
+    with span('disk', stations=len(sids)) as s:
+        for sid in dict.fromkeys(sids):
+            parsed = loadParsed(cache, sid, dataset, year)
+            if parsed is not None:
+                results[sid] = parsed
+                continue
+            body = cache.get(sid, dataset, year)
+            if body is not None:
+                bodies[sid] = body
+        s.set(hits=len(results) + len(bodies), parsed=len(results), misses=len(set(sids)) - len(results) - len(bodies),
+              bytes=sum(map(len, bodies.values())))
+
+    missing = [sid for sid in dict.fromkeys(sids) if sid not in results and sid not in bodies]
+    bodies.update(refreshStationYears(missing, year))
+    missing = [sid for sid in missing if sid not in bodies]
+    for i in range(0, len(missing), maxBatchStations):
+        batch = missing[i:i + maxBatchStations]
+        url = buildNoaaUrl(batch, dataset, f"{year}-01-01", f"{year}-12-31", dailyDataTypes)
+        for sid, body in splitCsvByStation(requestNoaaCsv(url), batch).items():
+            cache.put(sid, dataset, year, body, csvLastDate(body))
+            bodies[sid] = body
+
+    for sid, body in bodies.items():
+        results[sid] = parseAndStore(cache, sid, dataset, year, body)
+    return [results[sid] for sid in sids]
+
+def loadStationYears(sid, years):
+    # Parsed years from disk, with one NCEI request per run of consecutive years that are not
+    # there yet. Nothing is memoised, so fetchClimatology can pull a century through it.
+    dataset = 'daily-summaries'
+    cache = getStationCache()
+    results = {}
+    bodies = {}
+    with span('disk', sid=sid, years=len(years)) as s:
+        for year in years:
+            parsed = loadParsed(cache, sid, dataset, year)
+            if parsed is not None:
+                results[year] = parsed
+                continue
+            body = cache.get(sid, dataset, year)
+            if body is not None:
+                bodies[year] = body
+        s.set(hits=len(results) + len(bodies), parsed=len(results),
+              misses=len(years) - len(results) - len(bodies), bytes=sum(map(len, bodies.values())))
+
+    for year in years:
+        if year not in results and year not in bodies:
+            refreshed = refreshStationYears([sid], year)
+            if sid in refreshed:
+                bodies[year] = refreshed[sid]
+
+    missing = [year for year in years if year not in results and year not in bodies]
+    runs = []
+    for year in missing:
+        if runs and runs[-1][-1] == year - 1:
+            runs[-1].append(year)
+        else:
+            runs.append([year])
+    for run in runs:
+        url = buildNoaaUrl([sid], dataset, f"{run[0]}-01-01", f"{run[-1]}-12-31", dailyDataTypes)
+        for year, body in splitCsvByYear(requestNoaaCsv(url), run).items():
+            cache.put(sid, dataset, year, body, csvLastDate(body))
+            bodies[year] = body
+
+    for year, body in bodies.items():
+        results[year] = parseAndStore(cache, sid, dataset, year, body)
+    return [results[year] for year in years]
+
+@functools.lru_cache(maxsize=64)
+def fetchStationYears(sid, startYear, endYear, epoch=None):
+    # Years missing from disk are fetched together first; then every year comes through the
+    # per-year memo, so a year parsed for one view is shared with every other view of it
+    dataset = 'daily-summaries'
+    cache = getStationCache()
+    years = list(range(startYear, endYear + 1))
+    missing = [year for year in years if not cache.has(sid, dataset, year)]
+    if missing:
+        loadStationYears(sid, missing)
+    return [fetchStationYear(sid, year, False, refreshEpoch(year)) for year in years]
+
+def metricColumn(metric, isClimate=False):
+    if isClimate:
+        if 'Maximum' in metric: return 'DLY-TMAX-NORMAL'
+        elif 'Minimum' in metric: return 'DLY-TMIN-NORMAL'
+        else: return 'DLY-TAVG-NORMAL'
+    if 'Maximum' in metric: return 'TMAX'
+    elif 'Minimum' in metric: return 'TMIN'
+    elif 'Average Temperature' in metric: return 'TAVG'
+    elif 'Precipitation' in metric: return 'PRCP'
+    elif 'Snowfall' in metric: return 'SNOW'
+    elif 'Average wind' in metric: return 'AWND'
+    elif '2-minute' in metric: return 'WSF2'
+    elif '5-second' in metric: return 'WSF5'
+    else: return 'TMAX'
+
+def selectMetric(wide, stationName, sid, year, metric, isClimate=False):
+    # A station that does not report the metric gets a blank series, which callers report as no data
+    targetCol = metricColumn(metric, isClimate)
+
+    # Fallback for TAVG
+    if not isClimate and targetCol == 'TAVG' and 'TAVG' not in wide:
+        if 'TMAX' in wide and 'TMIN' in wide:
+            vals = (wide['TMAX'].values + wide['TMIN'].values) / 2
+        else:
+            return StationSeries.blank(sid, year, metric, stationName), stationName
+    elif targetCol not in wide:
+        return StationSeries.blank(sid, year, metric, stationName), stationName
+    else:
+        vals = wide[targetCol].values
+
+    if 'temperature' in metric.lower() or 'wind' in metric.lower() or isClimate:
+        vals = np.round(vals)
+
+    return StationSeries(sid, stationName, None if isClimate else year, metric, vals), stationName
+
+def fetchMany(specs, metric):
+    # specs is a list of (sid, year, isClimate). Identical station-years are fetched once,
+    # distinct ones concurrently, and results come back in the order of specs.
+    keys = [(sid, None if isClimate else year, isClimate) for sid, year, isClimate in specs]
+    uniqueKeys = list(dict.fromkeys(keys))
+    with span('fetch', stations=len(uniqueKeys)) as s:
+        with ThreadPoolExecutor(max_workers=max(1, len(uniqueKeys))) as pool:
+            futures = {key: pool.submit(bound(fetchStationYear), *key, refreshEpoch(key[1])) for key in uniqueKeys}
+        s.set(cache='miss' if s.children else 'hit')
+    return [selectMetric(*futures[key].result(), sid, year, metric, isClimate)
+            for (sid, year, isClimate), key in zip(specs, keys)]
+
+def fetchStations(sids, year, metric):
+    with span('fetch', stations=len(sids)) as s:
+        wideResults = fetchStationsYear(tuple(sids), year, refreshEpoch(year))
+        s.set(cache='miss' if s.children else 'hit')
+    return [selectMetric(wide, stationName, sid, year, metric) for sid, (wide, stationName) in zip(sids, wideResults)]
+
+def fetchRange(sid, startYear, endYear, metric):
+    yearList = range(startYear, endYear + 1)
+    with span('fetch', sid=sid, years=len(yearList)) as s:
+        wideResults = fetchStationYears(sid, startYear, endYear, refreshEpoch(endYear))
+        s.set(cache='miss' if s.children else 'hit')
+    stationName = next((name for wide, name in wideResults if wide), sid)
+    series = [selectMetric(wide, stationName, sid, year, metric)[0]
+              for year, (wide, _) in zip(yearList, wideResults)]
+    return series, stationName
+
+
+@functools.lru_cache(maxsize=64)
+def fetchClimatology(sid, metric, lastYear):
+    # The station's whole period of record up to lastYear as one year x day-of-year matrix.
+    # It is built once from the per-year data, pulled in maxRangeYears chunks, and then kept
+    # on disk itself; lastYear is a completed year, so the entry never goes stale.
+    dataset = f"climatology {metricColumn(metric)}"
+    cache = getStationCache()
+    with span('disk', sid=sid, dataset=dataset) as s:
+        body = cache.get(sid, dataset, lastYear)
+        s.set(cache='miss' if body is None else 'hit', bytes=0 if body is None else len(body))
+    if body is not None:
+        return Climatology.fromBytes(body)
+
+    with span('climatology', sid=sid, metric=metric) as s:
+        chunks = [(start, min(start + maxRangeYears - 1, lastYear))
+                  for start in range(climatologyFirstYear, lastYear + 1, maxRangeYears)]
+        # The unmemoised loader, so a century of parsed years is not also held in memory
+        with ThreadPoolExecutor(max_workers=len(chunks)) as pool:
+            futures = [pool.submit(bound(loadStationYears), sid, list(range(start, end + 1))) for start, end in chunks]
+        wideResults = [result for future in futures for result in future.result()]
+        stationName = next((name for wide, name in wideResults if wide), sid)
+        seriesList = [selectMetric(wide, stationName, sid, year, metric)[0]
+                      for year, (wide, _) in zip(range(climatologyFirstYear, lastYear + 1), wideResults)]
+        climatology = Climatology.fromSeries(sid, stationName, metric, seriesList)
+        s.set(years=len(climatology.years))
+    cache.put(sid, dataset, lastYear, climatology.toBytes())
+    return climatology
+
+
+# ---- Views ----
+
+# What each mode draws from, e.g. Two Stations takes two stations and one year.
+# None means any number; the Normals modes ignore years.
+viewModes = {
+    'Single Station': (1, 1),
+    'Single Station (Two Years)': (1, 2),
+    'Two Stations': (2, 1),
+    'Year Range': (1, 2),
+    'Anomaly': (1, 1),
+    'Percentile': (1, 1),
+    'Normals Single Station': (1, None),
+    'Normals Two Stations': (2, None),
+}
+diffModes = {'Single Station (Two Years)', 'Two Stations', 'Anomaly', 'Normals Two Stations'}
+
+# The metrics each mode can draw. Climate normals only cover temperature, so neither the Normals
+# modes nor anything compared against normals or a temperature record take the other metrics.
+temperatureMetrics = ['Maximum temperature', 'Minimum temperature', 'Average Temperature']
+dailyMetrics = temperatureMetrics + [
+    'Precipitation', 'Snowfall', 'Average wind speed', 'Fastest 2-minute wind speed', 'Fastest 5-second wind speed',
+]
+viewMetrics = {
+    'Single Station': dailyMetrics,
+    'Single Station (Two Years)': dailyMetrics,
+    'Two Stations': dailyMetrics,
+    'Year Range': dailyMetrics,
+    'Anomaly': temperatureMetrics,
+    'Percentile': temperatureMetrics,
+    'Normals Single Station': temperatureMetrics,
+    'Normals Two Stations': temperatureMetrics,
+}
+
+CalendarView = namedtuple('CalendarView', 'series title metric isDiff year')
+YearGridView = namedtuple('YearGridView', 'seriesList years title metric')
+
+def stationView(series, name, year, metric):
+    if series.empty:
+        raise ViewError(f"No data for {name} in {year}.")
+    return CalendarView(series, f"{name}\n{metric} ({year})", metric, False, year)
+
+def buildView(mode, sids, years, metric, leapDay=defaultLeapDayPolicy, baseline=None):
+    # Fetches and combines everything one calendar needs. Year Range takes its first and last year;
+    # Percentile compares against the (first, last) baseline years, the whole record when None.
+    nSids, nYears = viewModes.get(mode, (None, None))
+    if nSids is None:
+        raise ViewError(f"Unknown mode {mode!r}.")
+    if metric not in viewMetrics[mode]:
+        raise ViewError(f"{mode} cannot show {metric!r}; it takes {', '.join(viewMetrics[mode])}.")
+    if len(sids) != nSids:
+        raise ViewError(f"{mode} needs {nSids} station(s), got {len(sids)}.")
+    if nYears is not None and len(years) != nYears:
+        raise ViewError(f"{mode} needs {nYears} year(s), got {len(years)}.")
+
+    if mode == 'Single Station':
+        ((series1, name1),) = fetchMany([(sids[0], years[0], False)], metric)
+        return stationView(series1, name1, years[0], metric)
+
+    if mode == 'Anomaly':
+        (seriesHist, name1), (seriesNorm, _) = fetchMany(
+            [(sids[0], years[0], False), (sids[0], normalsDisplayYear, True)], metric
+        )
+        if seriesHist.empty:
+            raise ViewError(f"No historical data found for {name1} in {years[0]}.")
+        if seriesNorm.empty:
+            raise ViewError(f"No Climate Normals found for {name1}. Cannot calculate anomaly.")
+        # Anomaly = Actual - Normal, slot by slot
+        with span('merge', mode=mode):
+            finalSeries = seriesHist - seriesNorm
+        return CalendarView(finalSeries, f"{name1}: {years[0]} Anomaly\n(vs 1991-2020 Normals)", metric, True, years[0])
+
+    if mode == 'Percentile':
+        year = years[0]
+        startYear, endYear = baseline or (None, None)
+        ((series1, name1),) = fetchMany([(sids[0], year, False)], metric)
+        if series1.empty:
+            raise ViewError(f"No data for {name1} in {year}.")
+        climatology = fetchClimatology(sids[0], metric, datetime.now().year - 1)
+        # The year itself is left out of its baseline, so a record day ranks above every other year
+        with span('merge', mode=mode):
+            ranks = climatology.percentileRanks(series1.values, startYear, endYear, exclude=year)
+            highs, _ = climatology.recordHighs(startYear, endYear, exclude=year)
+            lows, _ = climatology.recordLows(startYear, endYear, exclude=year)
+            newHighs = int((series1.values > highs).sum())
+            newLows = int((series1.values < lows).sum())
+        if np.isnan(ranks).all():
+            raise ViewError(f"Not enough years on record for {name1} to rank {year} against.")
+        first, last = climatology.coverage(startYear, endYear)
+        titleStr = f"{name1}: {year} {metric} Percentile\n(vs {first}-{last}, {newHighs} record highs, {newLows} record lows)"
+        return CalendarView(series1.withValues(ranks), titleStr, f"{metric} percentile", False, year)
+
+    if mode == 'Single Station (Two Years)':
+        year1, year2 = years
+        (series1, name1), (series2, _) = fetchMany([(sids[0], year1, False), (sids[0], year2, False)], metric)
+        if series1.empty or series2.empty:
+            raise ViewError("Data missing.")
+        with span('merge', mode=mode):
+            finalSeries = series1.minus(series2, leapDay=leapDay)
+        return CalendarView(finalSeries, f"{name1}: {year1} vs {year2}\n{metric}", metric, True, year1)
+
+    if mode == 'Two Stations':
+        (series1, name1), (series2, name2) = fetchMany([(sids[0], years[0], False), (sids[1], years[0], False)], metric)
+        if series1.empty or series2.empty:
+            raise ViewError("Data missing.")
+        with span('merge', mode=mode):
+            finalSeries = series1 - series2
+        return CalendarView(finalSeries, f"{name1} vs {name2}\n{metric} ({years[0]})", metric, True, years[0])
+
+    if mode == 'Year Range':
+        startYear, endYear = years
+        if not 0 <= endYear - startYear < maxRangeYears:
+            raise ViewError(f"Last Year must be after First Year and at most {maxRangeYears} years later.")
+        seriesList, name1 = fetchRange(sids[0], startYear, endYear, metric)
+        if all(series.empty for series in seriesList):
+            raise ViewError(f"No data for {name1} in {startYear}-{endYear}.")
+        return YearGridView(seriesList, list(range(startYear, endYear + 1)), f"{name1}\n{metric} ({startYear}-{endYear})", metric)
+
+    results = fetchMany([(sid, normalsDisplayYear, True) for sid in sids], metric)
+    series1, name1 = results[0]
+    if mode == 'Normals Single Station':
+        if series1.empty:
+            raise ViewError(f"No normals found for {name1}.")
+        return CalendarView(series1, f"{name1}\n{metric} (1991-2020 Normals)", metric, False, normalsDisplayYear)
+    series2, name2 = results[1]
+    if series1.empty or series2.empty:
+        raise ViewError("Normals missing.")
+    with span('merge', mode=mode):
+        finalSeries = series1 - series2
+    return CalendarView(finalSeries, f"{name1} vs {name2}\n{metric} (Normals)", metric, True, normalsDisplayYear)
+
+
+# ---- Colors ----
+
+def hexToRgba(hexColor):
+    h = hexColor.lstrip('#')
+    return (int(h[0:2], 16) / 255, int(h[2:4], 16) / 255, int(h[4:6], 16) / 255, 1.0)
+
+class ColorScale:
+    # Thresholds are sorted once at import; colors() maps a whole array of values in one call
+    def __init__(self, stops, whiteTextAbove, isDiverging=False, whiteTextBelow=None):
+        stops = sorted(stops, key=lambda x: x[0])
+        # Values arrive as float32, so thresholds are compared in float32 as well;
+        # otherwise a stored 0.01 would fall just below the 0.01 stop
+        self.thresholds = np.array([t for t, _ in stops], dtype=np.float32)
+        self.rgba = np.array([hexToRgba(c) for _, c in stops])
+        self.whiteTextAbove = whiteTextAbove
+        self.whiteTextBelow = whiteTextBelow
+        self.isDiverging = isDiverging
+
+    def indices(self, vals):
+        # Index into the stops for each value, -1 for values below the lowest threshold
+        vals = np.asarray(vals, dtype=np.float32)
+        idx = np.searchsorted(self.thresholds, vals, side='right') - 1
+        if self.isDiverging:
+            # Between two stops negatives take the lower stop and positives the upper one
+            inside = (vals > self.thresholds[0]) & (vals < self.thresholds[-1])
+            idx = np.where(inside & (vals > 0), idx + 1, idx)
+            idx = np.clip(idx, 0, len(self.thresholds) - 1)
+            idx = np.where(inside & (vals == 0), -1, idx)
+        return idx
+
+    def colors(self, vals):
+        vals = np.asarray(vals, dtype=np.float32)
+        idx = self.indices(vals)
+        out = self.rgba[np.clip(idx, 0, None)]
+        out[idx < 0] = (1.0, 1.0, 1.0, 1.0)
+        out[np.isnan(vals)] = (0.0, 0.0, 0.0, 1.0)
+        return out
+
+    def textColors(self, vals):
+        vals = np.asarray(vals, dtype=np.float32)
+        mag = np.abs(vals) if self.isDiverging else vals
+        white = mag > self.whiteTextAbove
+        if self.whiteTextBelow is not None:
+            white |= vals < self.whiteTextBelow
+        return np.where(white, 'white', 'black')
+
+tempColorScale = ColorScale([
+    (0, '#E4E4F7'), (2, '#E4E1FD'), (4, '#DBCBFF'), (6, '#D1A9FF'), (8, '#BF88FF'),
+    (10, '#A373E5'), (12, '#8F5BBF'), (14, '#733DA3'), (16, '#5D2F8F'), (18, '#420078'),
+    (20, '#32007E'), (22, '#2A0099'), (24, '#1400A0'), (32, '#0f51d4'), (34, '#0f75d4'),
+    (36, '#0f8cd4'), (38, '#0fa6d4'), (40, '#0fbdd4'), (45, '#00e8e8'), (47, '#00e8d0'),
+    (48, '#00e8d0'), (49, '#00e8d0'), (50, '#00e8d0'), (51, '#4edec9'), (52, '#4edec9'),
+    (53, '#4ddfb4'), (54, '#4ddfb4'), (55, '#1cb769'), (56, '#1cb769'), (57, '#1cb769'),
+    (58, '#1cb769'), (59, '#1cb769'), (60, '#42b51b'), (61, '#42b51b'), (62, '#42b51b'),
+    (63, '#42b51b'), (64, '#42b51b'), (65, '#42b51b'), (66, '#aae71d'), (67, '#aae71d'),
+    (68, '#aae71d'), (69, '#aae71d'), (70, '#aae71d'), (71, '#defe01'), (72, '#defe01'),
+    (73, '#fff200'), (74, '#fff200'), (75, '#ffdb0f'), (76, '#ffdb0f'), (77, '#ffdb0f'),
+    (78, '#ffb10f'), (79, '#ffb10f'), (80, '#ff990f'), (81, '#ff990f'), (82, '#ff810f'),
+    (83, '#ff810f'), (84, '#ff450f'), (85, '#ff450f'), (86, '#ed1c24'), (87, '#ed1c24'),
+    (88, '#ed1c24'), (89, '#ed1c24'), (90, '#ed1c24'), (91, '#ed1c24'), (92, '#ed1c24'),
+    (93, '#ed1c24'), (94, '#ed1c24'), (95, '#ed1c24'), (96, '#db111c'), (97, '#db111c'),
+    (98, '#db111c'), (99, '#db111c'), (100, '#cf0e3f'), (101, '#cf0e3f'), (102, '#c10d63'),
+    (103, '#c10d63'), (104, '#f578b4'), (105, '#f02686'), (106, '#f02686'), (107, '#f34e9c'),
+    (108, '#f34e9c'), (109, '#f578b4'), (110, '#f578b4'), (111, '#f578b4'), (112, '#f578b4'),
+    (113, '#fcabfa'), (114, '#fcabfa'), (115, '#fcabfa'), (116, '#fcabfa'), (117, '#cd00f9'),
+    (118, '#cd00f9'), (119, '#cd00f9'), (120, '#cd00f9'), (121, '#cd00f9')
+], whiteTextAbove=100)
+
+precipColorScale = ColorScale([
+    (0.00, '#ffffff'), (0.01, '#e0f3db'), (0.10, '#ccebc5'), (0.25, '#a8ddb5'),
+    (0.50, '#7bccc4'), (0.75, '#4eb3d3'), (1.00, '#2b8cbe'), (1.50, '#0868ac'),
+    (2.00, '#084081'), (3.00, '#810f7c'), (4.00, '#4d004b')
+], whiteTextAbove=1.0)
+
+snowColorScale = ColorScale([
+    (0.0, '#ffffff'), (0.1, '#e0f7fa'), (1.0, '#b2ebf2'), (2.0, '#80deea'),
+    (4.0, '#4dd0e1'), (6.0, '#26c6da'), (8.0, '#00bcd4'), (12.0, '#0097a7'),
+    (18.0, '#006064'), (24.0, '#6a1b9a'), (36.0, '#4a148c')
+], whiteTextAbove=6.0)
+
+windColorScale = ColorScale([
+    (0, '#ffffff'), (5, '#e5f5e0'), (10, '#a1d99b'), (15, '#41ab5d'),
+    (20, '#fecc5c'), (25, '#fd8d3c'), (30, '#f03b20'), (40, '#bd0026'),
+    (50, '#800026'), (60, '#5a001a'), (70, '#3d0011')
+], whiteTextAbove=30)
+
+diffColorScale = ColorScale([
+    (-30, '#08306b'), (-20, '#08519c'), (-15, '#2171b5'), (-10, '#4292c6'),
+    (-5, '#6baed6'), (-3, '#9ecae1'), (-1, '#c6dbef'),
+    (0, '#ffffff'),
+    (1, '#fee0d2'), (3, '#fcbba1'), (5, '#fc9272'), (10, '#fb6a4a'),
+    (15, '#ef3b2c'), (20, '#cb181d'), (30, '#99000d')
+], whiteTextAbove=20, isDiverging=True)
+
+# Percentile ranks 0-100: blues for unusually low days, reds for unusually high ones
+percentileColorScale = ColorScale([
+    (0, '#08306b'), (2, '#08519c'), (5, '#2171b5'), (10, '#6baed6'), (25, '#c6dbef'),
+    (40, '#ffffff'), (60, '#fee0d2'), (75, '#fc9272'), (90, '#ef3b2c'), (95, '#cb181d'), (98, '#67000d')
+], whiteTextAbove=89, whiteTextBelow=10)
+
+def pickColorScale(metricName, isDiffMode):
+    if 'percentile' in metricName:
+        return percentileColorScale
+    elif isDiffMode:
+        return diffColorScale
+    elif 'Precipitation' in metricName:
+        return precipColorScale
+    elif 'Snowfall' in metricName:
+        return snowColorScale
+    elif 'wind' in metricName.lower():
+        return windColorScale
+    else:
+        return tempColorScale
+
+
+# ---- Rendering ----
+
+def buildCalendarGrid(series, yearForPlot):
+    # 12x31 array of values indexed by [month - 1, day - 1], NaN where there is no data.
+    # NCEI reports at most two decimals, so the float32 values are snapped back to them for labels.
+    grid = np.full((12, 31), np.nan)
+    valid = validSlots(yearForPlot)
+    grid[slotMonths[valid] - 1, slotDays[valid] - 1] = np.round(series.values[valid].astype(np.float64), 2)
+    return grid
+
+def newFigure(figsize):
+    # matplotlib is imported on the first PNG, not with this module: it is most of a cold start and
+    # the interactive chart never needs it. Figures sit on the Agg canvas directly rather than going
+    # through pyplot, so there is no GUI backend to pick and no global figure list to close them out of.
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+    fig = Figure(figsize=figsize)
+    FigureCanvasAgg(fig)
+    fig.patch.set_facecolor('black')
+    return fig
+
+pngDpi = 200
+
+def encodePng(fig, bboxInches='tight'):
+    # Same encoding st.pyplot uses
+    with span('encode') as s:
+        buf = io.BytesIO()
+        fig.savefig(buf, format='png', bbox_inches=bboxInches, dpi=pngDpi)
+        png = buf.getvalue()
+        s.set(bytes=len(png))
+    return png
+
+def cellLabels(vals, metricName, isDiffMode):
+    # The text shown in each cell, the same for the PNG and the interactive chart
+    labels = []
+    for val in vals:
+        if ('Precipitation' in metricName or 'Snowfall' in metricName) and not isDiffMode:
+            if val == 0: displayVal = ""
+            elif val < 1: displayVal = f"{val:.2f}".lstrip('0')
+            else: displayVal = f"{val:.1f}"
+        else:
+            displayVal = str(int(round(val)))
+        labels.append(displayVal)
+    return labels
+
+def cellPayload(seriesList, yearList, metricName, isDiffMode):
+    # One record per filled cell: where it goes, its value, and the color and label already worked out,
+    # so the browser only has to place them
+    activeScale = pickColorScale(metricName, isDiffMode)
+    cells = []
+    for series, year in zip(seriesList, yearList):
+        grid = buildCalendarGrid(series, year)
+        rows, cols = np.nonzero(~np.isnan(grid))
+        cellVals = grid[rows, cols]
+        fills = (activeScale.colors(cellVals)[:, :3] * 255).round().astype(int)
+        for month, day, val, fill, label, ink in zip(rows + 1, cols + 1, cellVals, fills,
+                                                     cellLabels(cellVals, metricName, isDiffMode),
+                                                     activeScale.textColors(cellVals)):
+            cells.append({
+                'year': year, 'month': calendar.month_name[month], 'day': int(day),
+                'date': f"{calendar.month_abbr[month]} {day}", 'value': round(float(val), 2),
+                'label': label, 'fill': '#%02x%02x%02x' % tuple(fill), 'ink': str(ink),
+            })
+    return cells
+
+def vegaLiteSpec(view):
+    # A Vega-Lite chart of the view's cells, with hover tooltips, for st.vega_lite_chart.
+    # Colors come precomputed in the payload, so every scale is switched off.
+    monthNames = list(calendar.month_name[1:])
+    axisStyle = {'labelColor': 'white', 'title': None, 'domain': False, 'ticks': False, 'labelAngle': 0}
+    encoding = {
+        'x': {'field': 'day', 'type': 'ordinal', 'scale': {'domain': list(range(1, 32))}, 'axis': axisStyle},
+        'y': {'field': 'month', 'type': 'ordinal', 'scale': {'domain': monthNames}, 'axis': axisStyle},
+        'tooltip': [{'field': 'date', 'title': 'Date'}, {'field': 'value', 'title': view.metric}],
+    }
+    rect = {'mark': {'type': 'rect', 'stroke': 'black'},
+            'encoding': {'color': {'field': 'fill', 'type': 'nominal', 'scale': None}}}
+    spec = {
+        'background': 'black',
+        'title': {'text': view.title.split('\n'), 'color': 'white', 'fontSize': 18},
+        'config': {'view': {'stroke': None}},
+    }
+    if isinstance(view, YearGridView):
+        encoding['tooltip'].insert(0, {'field': 'year', 'title': 'Year'})
+        spec['data'] = {'values': cellPayload(view.seriesList, view.years, view.metric, False)}
+        spec['facet'] = {'field': 'year', 'type': 'ordinal', 'title': None,
+                         'header': {'labelColor': 'white', 'labelFontSize': 12}}
+        spec['columns'] = 2 if len(view.years) > 1 else 1
+        spec['spec'] = {'width': 360, 'height': 160, 'encoding': encoding, 'layer': [rect]}
+        return spec
+    text = {'mark': {'type': 'text', 'fontSize': 10},
+            'encoding': {'text': {'field': 'label'}, 'color': {'field': 'ink', 'type': 'nominal', 'scale': None}}}
+    spec['data'] = {'values': cellPayload([view.series], [view.year], view.metric, view.isDiff)}
+    spec.update({'width': 'container', 'height': 480, 'encoding': encoding, 'layer': [rect, text]})
+    return spec
+
+def renderPng(view):
+    if isinstance(view, YearGridView):
+        return encodePng(drawYearGrid(view.seriesList, view.years, view.title, view.metric))
+    with borrowCalendarTemplate() as template:
+        fig = template.draw(view.series, view.title, view.metric, view.isDiff, view.year)
+        return encodePng(fig, template.bbox)
+
+class CalendarTemplate:
+    # A single-calendar figure with everything that is the same on every render built once: the
+    # black background, ticks, month labels and limits, plus a cell and a label for each of the
+    # 12x31 month/day slots. draw() only recolors the cells, rewrites the labels and sets the title.
+    def __init__(self):
+        from matplotlib.collections import PolyCollection
+        self.fig = fig = newFigure((16, 10))
+        ax = fig.add_subplot()
+        ax.set_facecolor('black')
+
+        monthLabels = [calendar.month_name[m] for m in range(1, 13)]
+        ax.set_xticks(range(1, 32))
+        ax.set_xticklabels(range(1, 32), fontsize=10)
+        ax.set_yticks(range(12))
+        ax.set_yticklabels(monthLabels, fontsize=12)
+        ax.tick_params(colors='white')
+        ax.set_xlim(0.5, 32)
+        ax.set_ylim(-0.5, 11.5)
+        ax.invert_yaxis()
+        ax.set_frame_on(False)
+
+        # One collection for every slot; slots with no data get no fill and no edge, as if never drawn
+        rows, cols = np.divmod(np.arange(12 * 31), 31)
+        x0 = cols + 0.5
+        y0 = rows - 0.5
+        verts = np.stack([
+            np.column_stack([x0, y0]),
+            np.column_stack([x0 + 1, y0]),
+            np.column_stack([x0 + 1, y0 + 1]),
+            np.column_stack([x0, y0 + 1]),
+        ], axis=1)
+        self.cells = PolyCollection(verts, facecolors='none', edgecolors='none')
+        ax.add_collection(self.cells)
+        # The labels sit inside the axes, so they are left out of the layout and the saved bounding box
+        self.labels = [ax.text(col + 1, row, '', ha='center', va='center', fontsize=10, in_layout=False)
+                       for row, col in zip(rows, cols)]
+
+        self.title = ax.set_title('', color='white', fontsize=18)
+        self.titleHeight = None
+        self.bbox = None
+
+    def draw(self, series, titleStr, metricName, isDiffMode, yearForPlot):
+        activeScale = pickColorScale(metricName, isDiffMode)
+        grid = buildCalendarGrid(series, yearForPlot).ravel()
+        filled = ~np.isnan(grid)
+        shown = filled.astype(float)[:, None]
+        self.cells.set_facecolor(activeScale.colors(grid) * shown)
+        self.cells.set_edgecolor(np.array([0.0, 0.0, 0.0, 1.0]) * shown)
+
+        texts = np.full(len(grid), '', dtype=object)
+        texts[filled] = cellLabels(grid[filled], metricName, isDiffMode)
+        inks = np.full(len(grid), 'black', dtype=object)
+        inks[filled] = activeScale.textColors(grid[filled])
+        for label, text, ink in zip(self.labels, texts, inks):
+            label.set_text(text)
+            label.set_color(ink)
+        # Nothing else moves the layout, so tight_layout only reruns when the title's height changes
+        self.title.set_text(titleStr)
+        titleHeight = self.title.get_window_extent(self.fig.canvas.get_renderer()).height
+        if titleHeight != self.titleHeight:
+            self.fig.tight_layout()
+            # tight_layout leaves a placeholder engine behind, and savefig redraws for any engine
+            self.fig.set_layout_engine(None)
+            self.titleHeight = titleHeight
+
+        # bbox_inches='tight' would draw the whole figure once just to measure it; measuring the
+        # ticks and title at the output dpi gives the same box without drawing anything
+        from matplotlib import rcParams
+        layoutDpi = self.fig.dpi
+        self.fig.dpi = pngDpi
+        try:
+            self.bbox = self.fig.get_tightbbox(self.fig.canvas.get_renderer()).padded(rcParams['savefig.pad_inches'])
+        finally:
+            self.fig.dpi = layoutDpi
+        return self.fig
+
+# A render borrows an idle template so concurrent sessions never draw on the same figure;
+# a process keeps as many as it has had renders running at once
+_idleTemplates = []
+_templateLock = threading.Lock()
+
+@contextmanager
+def borrowCalendarTemplate():
+    with _templateLock:
+        template = _idleTemplates.pop() if _idleTemplates else None
+    if template is None:
+        with span('template'):
+            template = CalendarTemplate()
+    try:
+        yield template
+    finally:
+        with _templateLock:
+            _idleTemplates.append(template)
+
+def drawYearGrid(seriesList, yearList, titleStr, metricName):
+    # Small multiples: one compact unlabeled panel per year, all drawn in one figure with one color scale
+    activeScale = pickColorScale(metricName, False)
+    nCols = 2 if len(yearList) > 1 else 1
+    nRows = -(-len(yearList) // nCols)
+    fig = newFigure((16, 3.2 * nRows + 1))
+    axes = fig.subplots(nRows, nCols, squeeze=False)
+    fig.suptitle(titleStr, color='white', fontsize=18)
+
+    monthLabels = [calendar.month_abbr[m] for m in range(1, 13)]
+    for ax in axes.flat[len(yearList):]:
+        ax.set_visible(False)
+    for i, (series, year) in enumerate(zip(seriesList, yearList)):
+        ax = axes.flat[i]
+        ax.set_facecolor('black')
+        grid = buildCalendarGrid(series, year)
+        ax.imshow(activeScale.colors(grid), extent=(0.5, 31.5, 11.5, -0.5), aspect='auto', interpolation='nearest')
+        ax.hlines(np.arange(0.5, 11), 0.5, 31.5, colors='black', linewidth=0.5)
+        ax.vlines(np.arange(1.5, 31), -0.5, 11.5, colors='black', linewidth=0.5)
+        ax.set_title(str(year), color='white', fontsize=12)
+        ax.set_xticks([1, 10, 20, 31])
+        ax.set_yticks(range(12))
+        ax.set_yticklabels(monthLabels if i % nCols == 0 else [], fontsize=8)
+        ax.tick_params(colors='white', labelsize=8, length=0)
+        ax.set_frame_on(False)
+
+    fig.tight_layout()
+    return fig
@@ -0,0 +1,48 @@
+import os
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+defaultMaxEntries = int(os.environ.get('RENDER_CACHE_MAX_ENTRIES', 512))
+defaultMaxBytes = int(os.environ.get('RENDER_CACHE_MAX_BYTES', 128 * 1024 * 1024))
+
+# Everything that changes the picture; bump version whenever the drawing code changes.
+# renderer says what the entry holds: 'png' image bytes or a 'chart' spec as JSON.
+ViewKey = namedtuple('ViewKey', 'mode sids years metric isDiff options renderer version')
+
+
+class RenderCache:
+    # In-process LRU of encoded views, bounded by entry count and total bytes
+    def __init__(self, maxEntries=defaultMaxEntries, maxBytes=defaultMaxBytes):
+        self.maxEntries = maxEntries
+        self.maxBytes = maxBytes
+        self.entries = OrderedDict()
+        self.totalBytes = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            data, expiresAt = entry
+            if expiresAt is not None and time.time() > expiresAt:
+                self._remove(key)
+                return None
+            self.entries.move_to_end(key)
+            return data
+
+    def put(self, key, data, ttl=None):
+        if len(data) > self.maxBytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (data, None if ttl is None else time.time() + ttl)
+            self.totalBytes += len(data)
+            while len(self.entries) > self.maxEntries or self.totalBytes > self.maxBytes:
+                self._remove(next(iter(self.entries)))
+
+    def _remove(self, key):
+        data, _ = self.entries.pop(key)
+        self.totalBytes -= len(data)
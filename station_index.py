@@ -0,0 +1,209 @@
+import argparse
+import math
+import os
+import urllib.request
+
+import numpy as np
+
+defaultIndexDir = os.environ.get(
+    'STATION_INDEX_DIR',
+    os.path.join(os.path.expanduser('~'), '.cache', 'calendar_heatmaps', 'stations')
+)
+stationsUrl = "https://www.ncei.noaa.gov/pub/data/ghcn/daily/ghcnd-stations.txt"
+
+# One-degree grid over the globe; cellStarts is a CSR offset table into cellStations
+gridRows, gridCols = 180, 360
+kmPerDegree = 111.2
+# Rings nearest() grows before it falls back to measuring every station
+nearestMaxRings = 8
+# Most stations a name search returns
+searchLimit = 50
+
+arrayNames = ('ids', 'names', 'states', 'lat', 'lon', 'tokens', 'tokenStations', 'cellStarts', 'cellStations')
+
+
+def cellOf(lat, lon):
+    row = np.clip(np.floor(np.asarray(lat) + 90).astype(np.int64), 0, gridRows - 1)
+    col = np.clip(np.floor(np.asarray(lon) + 180).astype(np.int64), 0, gridCols - 1)
+    return row * gridCols + col
+
+
+def readInventory(path, element='TMAX'):
+    # ghcnd-inventory.txt: ID, LAT, LON, ELEMENT, FIRSTYEAR, LASTYEAR
+    withElement = set()
+    with open(path, encoding='latin-1') as f:
+        for line in f:
+            if line[31:35] == element:
+                withElement.add(line[0:11])
+    return withElement
+
+
+def buildStationIndex(stationsPath, outDir=defaultIndexDir, inventoryPath=None):
+    # ghcnd-stations.txt is fixed width: ID 1-11, LAT 13-20, LON 22-30, STATE 39-40, NAME 42-71
+    keep = readInventory(inventoryPath) if inventoryPath else None
+    rows = []
+    with open(stationsPath, encoding='latin-1') as f:
+        for line in f:
+            sid = line[0:11].strip()
+            if len(sid) != 11 or (keep is not None and sid not in keep):
+                continue
+            rows.append((sid, line[41:71].strip().upper(), line[38:40].strip(), float(line[12:20]), float(line[21:30])))
+    rows.sort()
+
+    ids = np.array([r[0] for r in rows], dtype='S11')
+    names = np.array([r[1].encode('ascii', 'replace') for r in rows], dtype='S30')
+    states = np.array([r[2] for r in rows], dtype='S2')
+    lat = np.array([r[3] for r in rows], dtype=np.float32)
+    lon = np.array([r[4] for r in rows], dtype=np.float32)
+
+    # Every word of a name is indexed so "FRAN" finds "SAN FRANCISCO DWTN"
+    tokenPairs = sorted(
+        (word.encode('ascii', 'replace'), i)
+        for i, (_, name, _, _, _) in enumerate(rows) for word in set(name.split())
+    )
+    tokens = np.array([t for t, _ in tokenPairs], dtype='S30')
+    tokenStations = np.array([i for _, i in tokenPairs], dtype=np.int32)
+
+    cells = cellOf(lat, lon)
+    cellStations = np.argsort(cells, kind='stable').astype(np.int32)
+    cellStarts = np.searchsorted(cells[cellStations], np.arange(gridRows * gridCols + 1)).astype(np.int32)
+
+    os.makedirs(outDir, exist_ok=True)
+    arrays = {
+        'ids': ids, 'names': names, 'states': states, 'lat': lat, 'lon': lon,
+        'tokens': tokens, 'tokenStations': tokenStations, 'cellStarts': cellStarts, 'cellStations': cellStations,
+    }
+    for name in arrayNames:
+        # Write then rename so a running app never maps a half-written file
+        tmpPath = os.path.join(outDir, f"{name}.tmp.npy")
+        np.save(tmpPath, arrays[name])
+        os.replace(tmpPath, os.path.join(outDir, f"{name}.npy"))
+    return len(ids)
+
+
+def loadStationIndex(indexDir=defaultIndexDir):
+    if not all(os.path.exists(os.path.join(indexDir, f"{name}.npy")) for name in arrayNames):
+        return None
+    return StationIndex(**{name: np.load(os.path.join(indexDir, f"{name}.npy"), mmap_mode='r') for name in arrayNames})
+
+
+class StationIndex:
+    # Read-only view over the memory-mapped arrays written by buildStationIndex
+    def __init__(self, ids, names, states, lat, lon, tokens, tokenStations, cellStarts, cellStations):
+        self.ids = ids
+        self.names = names
+        self.states = states
+        self.lat = lat
+        self.lon = lon
+        self.tokens = tokens
+        self.tokenStations = tokenStations
+        self.cellStarts = cellStarts
+        self.cellStations = cellStations
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _cellRange(self, rowLo, rowHi, colLo, colHi):
+        parts = []
+        # A span of 360 or more columns already covers every longitude once
+        cols = range(gridCols) if colHi - colLo + 1 >= gridCols else range(colLo, colHi + 1)
+        for row in range(max(rowLo, 0), min(rowHi, gridRows - 1) + 1):
+            for col in cols:
+                cell = row * gridCols + col % gridCols
+                parts.append(self.cellStations[self.cellStarts[cell]:self.cellStarts[cell + 1]])
+        return np.concatenate(parts) if parts else np.empty(0, dtype=np.int32)
+
+    def inBbox(self, bbox):
+        # bbox is [minLon, minLat, maxLon, maxLat], the order ACIS uses
+        minLon, minLat, maxLon, maxLat = bbox
+        rowLo, colLo = divmod(int(cellOf(minLat, minLon)), gridCols)
+        rowHi, colHi = divmod(int(cellOf(maxLat, maxLon)), gridCols)
+        cand = self._cellRange(rowLo, rowHi, colLo, colHi)
+        lat, lon = self.lat[cand], self.lon[cand]
+        return cand[(lat >= minLat) & (lat <= maxLat) & (lon >= minLon) & (lon <= maxLon)]
+
+    def nearest(self, lat, lon, n=10):
+        # Grow a ring of grid cells until the n-th closest station is nearer than anything outside the ring.
+        # Near the poles the east-west reach of a ring collapses, and a sparse area needs a wide ring,
+        # so after nearestMaxRings it is cheaper to measure every station in one pass.
+        row, col = divmod(int(cellOf(lat, lon)), gridCols)
+        if len(self) > n:
+            for ring in range(nearestMaxRings + 1):
+                cand = self._cellRange(row - ring, row + ring, col - ring, col + ring)
+                if len(cand) >= n:
+                    dist = self.distanceKm(lat, lon, cand)
+                    reach = ring * kmPerDegree * max(math.cos(math.radians(min(abs(lat) + ring, 89.0))), 0.01)
+                    if np.partition(dist, n - 1)[n - 1] <= reach:
+                        return cand[np.argsort(dist, kind='stable')[:n]]
+        cand = np.arange(len(self), dtype=np.int32)
+        dist = self.distanceKm(lat, lon, cand)
+        return cand[np.argsort(dist, kind='stable')[:n]]
+
+    def distanceKm(self, lat, lon, idx):
+        lat1, lon1 = math.radians(lat), math.radians(lon)
+        lat2, lon2 = np.radians(self.lat[idx].astype(np.float64)), np.radians(self.lon[idx].astype(np.float64))
+        a = np.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+        return 2 * 6371.0 * np.arcsin(np.sqrt(a))
+
+    def search(self, text, limit=searchLimit, near=None):
+        # Prefix match on station IDs and on every word of the station names, best first: stations
+        # with more words matching the query whole ("PORTLAND" before "PORTLANDVILLE"), then the
+        # closest to near=(lat, lon) when given, else by name. limit=None returns every hit.
+        words = text.strip().upper().split()
+        if not words:
+            return np.empty(0, dtype=np.int32)
+        hits = None
+        wholeWords = {}
+        for word in words:
+            prefix = word.encode('ascii', 'replace')
+            lo = np.searchsorted(self.tokens, prefix, side='left')
+            hi = np.searchsorted(self.tokens, prefix + b'\xff', side='left')
+            whole = np.searchsorted(self.tokens, prefix, side='right')
+            found = set(self.tokenStations[lo:hi].tolist())
+            hits = found if hits is None else hits & found
+            for i in self.tokenStations[lo:whole].tolist():
+                wholeWords[i] = wholeWords.get(i, 0) + 1
+        if len(words) == 1:
+            prefix = words[0].encode('ascii', 'replace')
+            lo = np.searchsorted(self.ids, prefix, side='left')
+            hi = np.searchsorted(self.ids, prefix + b'\xff', side='left')
+            hits |= set(range(lo, hi))
+            # A full station ID beats any name
+            whole = np.searchsorted(self.ids, prefix, side='right')
+            for i in range(lo, whole):
+                wholeWords[i] = len(words) + 1
+        hits = np.array(sorted(hits), dtype=np.int32)
+        score = np.array([wholeWords.get(i, 0) for i in hits.tolist()], dtype=np.int32)
+        after = self.distanceKm(near[0], near[1], hits) if near is not None else self.names[hits]
+        order = np.lexsort((after, -score))
+        return hits[order[:limit]]
+
+    def labels(self, idx):
+        # Same "Name (ID)" -> ID mapping findStationsAcis returns, kept in the order of idx
+        stations = {}
+        for i in idx:
+            name = self.names[i].decode('ascii').title()
+            state = self.states[i].decode('ascii')
+            sid = self.ids[i].decode('ascii')
+            stations[f"{name}, {state} ({sid})" if state else f"{name} ({sid})"] = sid
+        return stations
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the offline GHCN-Daily station index.")
+    parser.add_argument('stations', nargs='?', help="Path to ghcnd-stations.txt (downloaded when omitted)")
+    parser.add_argument('--inventory', help="Path to ghcnd-inventory.txt; keeps only stations reporting TMAX")
+    parser.add_argument('--out', default=defaultIndexDir, help="Directory for the index files")
+    args = parser.parse_args()
+
+    stationsPath = args.stations
+    if stationsPath is None:
+        os.makedirs(args.out, exist_ok=True)
+        stationsPath = os.path.join(args.out, 'ghcnd-stations.txt')
+        urllib.request.urlretrieve(stationsUrl, stationsPath)
+    count = buildStationIndex(stationsPath, args.out, args.inventory)
+    print(f"Indexed {count} stations into {args.out}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+import json
+import struct
+
+import numpy as np
+
+from alignment import nSlots, dateSlots, alignedDifference, defaultLeapDayPolicy
+
+_magic = b'SSR1'
+
+
+class StationSeries:
+    # One metric for one station-year: 366 float32 values with NaN marking missing days.
+    # Values are read-only so a single instance can be shared between sessions.
+    __slots__ = ('sid', 'name', 'year', 'metric', 'values')
+
+    def __init__(self, sid, name, year, metric, values):
+        values = np.asarray(values, dtype=np.float32)
+        if values.shape != (nSlots,):
+            raise ValueError(f"StationSeries needs {nSlots} values, got {values.shape}")
+        if values.flags.writeable:
+            values = values.copy()
+            values.flags.writeable = False
+        self.sid = sid
+        self.name = name
+        self.year = year
+        self.metric = metric
+        self.values = values
+
+    @classmethod
+    def blank(cls, sid, year=None, metric=None, name=None):
+        return cls(sid, name or sid, year, metric, np.full(nSlots, np.nan, dtype=np.float32))
+
+    @classmethod
+    def fromDates(cls, sid, name, year, metric, dates, vals):
+        values = np.full(nSlots, np.nan, dtype=np.float32)
+        values[dateSlots(dates)] = vals
+        return cls(sid, name, year, metric, values)
+
+    @property
+    def missing(self):
+        return np.isnan(self.values)
+
+    @property
+    def empty(self):
+        return bool(self.missing.all())
+
+    def withValues(self, values, **header):
+        fields = {'sid': self.sid, 'name': self.name, 'year': self.year, 'metric': self.metric}
+        fields.update(header)
+        return StationSeries(fields['sid'], fields['name'], fields['year'], fields['metric'], values)
+
+    def minus(self, other, leapDay=defaultLeapDayPolicy):
+        return self.withValues(alignedDifference(self.values, self.year, other.values, other.year, leapDay))
+
+    def __sub__(self, other):
+        return self.minus(other)
+
+    def toBytes(self):
+        # Small JSON header, padded to 4 bytes, followed by the raw little-endian float32 buffer
+        header = json.dumps([self.sid, self.name, self.year, self.metric]).encode('utf-8')
+        header += b' ' * (-(len(_magic) + 4 + len(header)) % 4)
+        return b''.join([_magic, struct.pack('<I', len(header)), header,
+                         memoryview(self.values.astype('<f4', copy=False)).cast('B')])
+
+    @classmethod
+    def fromBytes(cls, buf):
+        # The values are a read-only view into buf, nothing is copied
+        buf = memoryview(buf)
+        if bytes(buf[:4]) != _magic:
+            raise ValueError("Not a serialized StationSeries")
+        (headerLen,) = struct.unpack('<I', buf[4:8])
+        sid, name, year, metric = json.loads(bytes(buf[8:8 + headerLen]))
+        values = np.frombuffer(buf, dtype='<f4', count=nSlots, offset=8 + headerLen)
+        return cls(sid, name, year, metric, values)
+
+    def __repr__(self):
+        return f"StationSeries({self.sid!r}, {self.name!r}, {self.year!r}, {self.metric!r}, {int((~self.missing).sum())} days)"
+
+
+def packSeries(seriesList):
+    # Several series back to back, each behind its length, e.g. every column of one station-year.
+    # Each serialized series is a multiple of 4 bytes, so every values buffer stays aligned.
+    parts = []
+    for series in seriesList:
+        data = series.toBytes()
+        parts += [struct.pack('<I', len(data)), data]
+    return b''.join(parts)
+
+
+def unpackSeries(buf):
+    # The series from packSeries, each a read-only view into buf
+    buf = memoryview(buf)
+    seriesList = []
+    pos = 0
+    while pos < len(buf):
+        (size,) = struct.unpack('<I', buf[pos:pos + 4])
+        seriesList.append(StationSeries.fromBytes(buf[pos + 4:pos + 4 + size]))
+        pos += 4 + size
+    return seriesList
@@ -0,0 +1,87 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from alignment import (
+    alignedDifference, dateSlots, fillLeapDay, leapDayPolicies, leapDaySlot, nSlots,
+    slotDays, slotMonths, slotsOf, validSlots,
+)
+
+
+def yearValues(year, offset=0.0):
+    # A distinct value per slot, NaN on Feb 29 for common years as the parser leaves it
+    values = np.arange(nSlots, dtype=np.float32) + offset
+    values[~validSlots(year)] = np.nan
+    return values
+
+
+def test_slots_round_trip():
+    assert slotMonths[leapDaySlot] == 2 and slotDays[leapDaySlot] == 29
+    np.testing.assert_array_equal(slotsOf(slotMonths, slotDays), np.arange(nSlots))
+    dates = pd.date_range('2024-01-01', '2024-12-31')
+    np.testing.assert_array_equal(dateSlots(dates), np.arange(nSlots))
+    common = pd.date_range('2023-01-01', '2023-12-31')
+    np.testing.assert_array_equal(dateSlots(common), np.flatnonzero(validSlots(2023)))
+
+
+def test_valid_slots():
+    assert validSlots(2024).all()
+    assert validSlots(None).all()
+    assert np.flatnonzero(~validSlots(2023)).tolist() == [leapDaySlot]
+    assert np.flatnonzero(~validSlots(1900)).tolist() == [leapDaySlot]
+
+
+@pytest.mark.parametrize('policy, expected', [
+    ('drop', np.nan),
+    ('feb28', 1059 - 58.0),
+    ('interpolate', 1059 - (58 + 60) / 2),
+])
+def test_leap_minus_common(policy, expected):
+    leap, common = yearValues(2024, 1000), yearValues(2023)
+    diff = alignedDifference(leap, 2024, common, 2023, policy)
+    other = np.arange(nSlots) != leapDaySlot
+    np.testing.assert_array_equal(diff[other], np.full(other.sum(), 1000, dtype=np.float32))
+    np.testing.assert_equal(diff[leapDaySlot], expected)
+    assert diff.dtype == np.float32
+
+
+@pytest.mark.parametrize('policy', leapDayPolicies)
+def test_common_minus_leap(policy):
+    # Laid out on the common year's calendar, so Feb 29 stays empty whatever the policy
+    common, leap = yearValues(2023, 1000), yearValues(2024)
+    diff = alignedDifference(common, 2023, leap, 2024, policy)
+    assert np.isnan(diff[leapDaySlot])
+    other = np.arange(nSlots) != leapDaySlot
+    np.testing.assert_array_equal(diff[other], np.full(other.sum(), 1000, dtype=np.float32))
+
+
+@pytest.mark.parametrize('policy', leapDayPolicies)
+def test_common_minus_normals(policy):
+    common, normals = yearValues(2023, 1000), yearValues(None)
+    diff = alignedDifference(common, 2023, normals, None, policy)
+    assert np.isnan(diff[leapDaySlot])
+    assert np.isnan(diff).sum() == 1
+
+
+@pytest.mark.parametrize('policy', leapDayPolicies)
+def test_fill_leap_day_leaves_leap_years_alone(policy):
+    for year in (2024, None):
+        values = yearValues(year)
+        assert fillLeapDay(values, year, policy) is values
+
+
+def test_fill_leap_day_common_year():
+    values = yearValues(2023)
+    assert np.isnan(fillLeapDay(values, 2023, 'drop')[leapDaySlot])
+    assert fillLeapDay(values, 2023, 'feb28')[leapDaySlot] == values[leapDaySlot - 1]
+    assert fillLeapDay(values, 2023, 'interpolate')[leapDaySlot] == (values[leapDaySlot - 1] + values[leapDaySlot + 1]) / 2
+    # The input is never written to
+    assert np.isnan(values[leapDaySlot])
+
+
+def test_unknown_policy():
+    values = yearValues(2023)
+    with pytest.raises(ValueError, match='leap-day policy'):
+        fillLeapDay(values, 2023, 'nearest')
+    with pytest.raises(ValueError, match='leap-day policy'):
+        alignedDifference(yearValues(2024), 2024, values, 2023, 'nearest')
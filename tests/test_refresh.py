@@ -0,0 +1,110 @@
+import sqlite3
+from contextlib import closing
+from datetime import date, timedelta
+
+import pytest
+
+import pipeline
+from pipeline import csvLastDate, mergeCsv, refreshStationYears
+
+header = b'"STATION","DATE","TMAX","TMIN"\n'
+
+
+def row(day, tmax='10', tmin='1', sid='USW00094728'):
+    return f'"{sid}","{day}","{tmax}","{tmin}"\n'.encode('ascii')
+
+
+def body(*days):
+    return header + b''.join(row(day) for day in days)
+
+
+@pytest.fixture
+def cache(tmp_path):
+    pipeline.configure(cachePath=str(tmp_path / 'noaa.sqlite3'))
+    yield pipeline.getStationCache()
+    pipeline.resetCaches()
+
+
+def expire(cache):
+    # Backdates every entry past the running-year TTL
+    with closing(sqlite3.connect(cache.path)) as conn, conn:
+        conn.execute('UPDATE station_year SET fetched_at = fetched_at - ?', (cache.currentYearTtl + 1,))
+
+
+def test_csv_last_date():
+    assert csvLastDate(body('2024-03-01', '2024-03-02')) == '2024-03-02'
+    assert csvLastDate(header + b'"USW00094728","2024-03-02T00:00:00","1","2"\r\n') == '2024-03-02'
+    assert csvLastDate(header) is None
+    assert csvLastDate(b'') is None
+
+
+def test_merge_cuts_at_since():
+    stored = body('2024-03-01', '2024-03-02', '2024-03-03')
+    fresh = header + row('2024-03-02', tmax='12') + row('2024-03-03') + row('2024-03-04')
+    merged = mergeCsv(stored, fresh, '2024-03-02')
+    assert merged == header + row('2024-03-01') + row('2024-03-02', tmax='12') + row('2024-03-03') + row('2024-03-04')
+
+
+def test_merge_keeps_stored_without_a_trailing_newline():
+    stored = body('2024-03-01').rstrip(b'\n')
+    merged = mergeCsv(stored, body('2024-03-02'), '2024-03-02')
+    assert merged == body('2024-03-01', '2024-03-02')
+
+
+def test_merge_empty_window_keeps_stored():
+    stored = body('2024-03-01', '2024-03-02')
+    assert mergeCsv(stored, header, '2024-03-02') is stored
+    assert mergeCsv(stored, b'', '2024-03-02') is stored
+
+
+def test_merge_header_mismatch_rewrites_under_union():
+    stored = body('2024-03-01', '2024-03-02')
+    fresh = b'"STATION","DATE","TMAX","PRCP"\n"USW00094728","2024-03-02","11","5"\n'
+    merged = mergeCsv(stored, fresh, '2024-03-02')
+    assert merged == (
+        b'"STATION","DATE","TMAX","TMIN","PRCP"\n'
+        b'"USW00094728","2024-03-01","10","1",""\n'
+        b'"USW00094728","2024-03-02","11","","5"\n'
+    )
+    assert csvLastDate(merged) == '2024-03-02'
+
+
+def test_refresh_restamps_when_nothing_can_be_new(cache, monkeypatch):
+    # A last date past today, less the overlap, leaves an empty window; nothing is requested
+    def requestNoaaCsv(url):
+        raise AssertionError(url)
+    monkeypatch.setattr(pipeline, 'requestNoaaCsv', requestNoaaCsv)
+    year = date.today().year
+    lastDate = (date.today() + timedelta(days=pipeline.refreshOverlapDays + 1)).isoformat()
+    stored = body(lastDate)
+    cache.put('USW00094728', 'daily-summaries', year, stored, lastDate)
+    expire(cache)
+    assert not cache.has('USW00094728', 'daily-summaries', year)
+
+    assert refreshStationYears(['USW00094728'], year) == {'USW00094728': stored}
+    assert cache.has('USW00094728', 'daily-summaries', year)
+    assert cache.getStale('USW00094728', 'daily-summaries', year) == (stored, lastDate)
+
+
+def test_refresh_merges_trailing_window(cache, monkeypatch):
+    year = date.today().year
+    lastDay = max(date.today() - timedelta(days=2), date(year, 1, 1))
+    stored = body(lastDay.isoformat())
+    cache.put('USW00094728', 'daily-summaries', year, stored, lastDay.isoformat())
+    requested = []
+
+    def requestNoaaCsv(url):
+        requested.append(url)
+        return header + row(lastDay.isoformat(), tmax='12') + row(date.today().isoformat())
+    monkeypatch.setattr(pipeline, 'requestNoaaCsv', requestNoaaCsv)
+
+    merged = header + row(lastDay.isoformat(), tmax='12') + row(date.today().isoformat())
+    assert refreshStationYears(['USW00094728', 'USW00094728'], year) == {'USW00094728': merged}
+    since = max(lastDay - timedelta(days=pipeline.refreshOverlapDays), date(year, 1, 1)).isoformat()
+    assert len(requested) == 1 and f'startDate={since}' in requested[0]
+    assert cache.getStale('USW00094728', 'daily-summaries', year) == (merged, date.today().isoformat())
+
+
+def test_refresh_skips_stations_without_stale_entries(cache, monkeypatch):
+    monkeypatch.setattr(pipeline, 'requestNoaaCsv', lambda url: pytest.fail(url))
+    assert refreshStationYears(['USW00094728'], date.today().year) == {}
@@ -0,0 +1,87 @@
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+# One JSON object per finished span, e.g. {"stage": "ncei", "ms": 812.4, "bytes": 48211, ...}.
+# SPAN_LOG=0 turns the log lines off; the in-app trace is always collected.
+logger = logging.getLogger('calendar_heatmaps.spans')
+if os.environ.get('SPAN_LOG', '1') != '0' and not logger.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+_trace = contextvars.ContextVar('trace', default=None)
+_parent = contextvars.ContextVar('parentSpan', default=None)
+
+
+class Trace:
+    # Every span finished during one script run, from any thread that inherited its context
+    def __init__(self):
+        self.traceId = uuid.uuid4().hex[:12]
+        self.started = time.perf_counter()
+        self.spans = []
+        self.lock = threading.Lock()
+
+    def add(self, record):
+        with self.lock:
+            self.spans.append(record)
+
+
+class Span:
+    __slots__ = ('stage', 'attrs', 'children')
+
+    def __init__(self, stage, attrs):
+        self.stage = stage
+        self.attrs = attrs
+        self.children = 0
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def add(self, key, amount):
+        self.attrs[key] = self.attrs.get(key, 0) + amount
+
+
+def startTrace():
+    trace = Trace()
+    _trace.set(trace)
+    return trace
+
+
+@contextmanager
+def span(stage, **attrs):
+    current = Span(stage, attrs)
+    parent = _parent.get()
+    if parent is not None:
+        parent.children += 1
+    token = _parent.set(current)
+    trace = _trace.get()
+    started = time.perf_counter()
+    try:
+        yield current
+    except BaseException as e:
+        current.attrs['error'] = type(e).__name__
+        raise
+    finally:
+        _parent.reset(token)
+        record = {'stage': stage, 'ms': round((time.perf_counter() - started) * 1000, 2),
+                  'parent': parent.stage if parent is not None else None}
+        record.update(current.attrs)
+        if trace is not None:
+            record['trace'] = trace.traceId
+            record['at'] = round((started - trace.started) * 1000, 2)
+            trace.add(record)
+        logger.info(json.dumps(record, default=str))
+
+
+def bound(fn):
+    # Runs fn in a copy of the caller's context, so spans from pool threads join the caller's trace
+    ctx = contextvars.copy_context()
+    return lambda *args, **kwargs: ctx.run(fn, *args, **kwargs)
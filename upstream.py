@@ -0,0 +1,151 @@
+import json
+import os
+import random
+import threading
+import time
+from contextlib import nullcontext
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from timing import span
+
+defaultConnectTimeout = float(os.environ.get('UPSTREAM_CONNECT_TIMEOUT', 5))
+defaultReadTimeout = float(os.environ.get('UPSTREAM_READ_TIMEOUT', 30))
+# Wall-clock cap on a whole response, since the read timeout only bounds the gap between packets
+defaultDeadline = float(os.environ.get('UPSTREAM_DEADLINE', 120))
+defaultRetries = int(os.environ.get('UPSTREAM_RETRIES', 2))
+defaultBackoff = float(os.environ.get('UPSTREAM_BACKOFF', 0.5))
+defaultHostLimit = int(os.environ.get('UPSTREAM_HOST_LIMIT', 8))
+
+retryStatuses = {429, 500, 502, 503, 504}
+headBytes = 512
+
+
+class UpstreamError(Exception):
+    def __init__(self, message, status=None, retryable=False):
+        super().__init__(message)
+        self.status = status
+        self.retryable = retryable
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    # Concurrent calls with the same key share one execution and its result or exception
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def do(self, key, fn):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = _Call()
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+
+
+class UpstreamClient:
+    # Shared by every session: one pooled session and one concurrency cap per host
+    def __init__(self, connectTimeout=defaultConnectTimeout, readTimeout=defaultReadTimeout,
+                 deadline=defaultDeadline, retries=defaultRetries, backoff=defaultBackoff,
+                 hostLimits=None, defaultHostLimit=defaultHostLimit, sharedSlots=None):
+        self.timeout = (connectTimeout, readTimeout)
+        self.deadline = deadline
+        self.retries = retries
+        self.backoff = backoff
+        self.hostLimits = dict(hostLimits or {})
+        self.defaultHostLimit = defaultHostLimit
+        # Optional cap shared with other processes, e.g. a multiprocessing.BoundedSemaphore
+        self.sharedSlots = sharedSlots if sharedSlots is not None else nullcontext()
+        self.hosts = {}
+        self.lock = threading.Lock()
+        self.flights = SingleFlight()
+
+    def _host(self, host):
+        with self.lock:
+            entry = self.hosts.get(host)
+            if entry is None:
+                limit = self.hostLimits.get(host, self.defaultHostLimit)
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=limit)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                entry = self.hosts[host] = (session, threading.BoundedSemaphore(limit))
+            return entry
+
+    def fetch(self, url, method='GET', params=None, payload=None, headers=None, checkHead=None):
+        # Returns the response body as bytes or raises UpstreamError; nothing is cached here,
+        # so callers never mistake a failure for an empty result
+        key = (method, url, json.dumps(params, sort_keys=True), json.dumps(payload, sort_keys=True))
+        return self.flights.do(key, lambda: self._fetchWithRetries(url, method, params, payload, headers, checkHead))
+
+    def fetchJson(self, url, method='GET', params=None, payload=None, headers=None):
+        body = self.fetch(url, method, params, payload, headers)
+        try:
+            return json.loads(body)
+        except ValueError as e:
+            raise UpstreamError(f"{urlsplit(url).netloc} returned invalid JSON") from e
+
+    def _fetchWithRetries(self, url, method, params, payload, headers, checkHead):
+        for attempt in range(self.retries + 1):
+            try:
+                return self._fetchOnce(url, method, params, payload, headers, checkHead, attempt)
+            except UpstreamError as e:
+                if not e.retryable or attempt == self.retries:
+                    raise
+            # Full jitter keeps sessions that failed together from retrying together
+            time.sleep(random.uniform(0, self.backoff * 2 ** attempt))
+
+    def _fetchOnce(self, url, method, params, payload, headers, checkHead, attempt=0):
+        host = urlsplit(url).netloc
+        session, slots = self._host(host)
+        with span('http', host=host, attempt=attempt) as s, slots, self.sharedSlots:
+            started = time.monotonic()
+            try:
+                with session.request(method, url, params=params, json=payload, headers=headers,
+                                     timeout=self.timeout, stream=True) as r:
+                    s.set(status=r.status_code)
+                    if r.status_code != 200:
+                        raise UpstreamError(f"{host} returned status {r.status_code}",
+                                            r.status_code, r.status_code in retryStatuses)
+                    body = bytearray()
+                    checked = checkHead is None
+                    for chunk in r.iter_content(chunk_size=64 * 1024):
+                        body += chunk
+                        if not checked and len(body) >= headBytes:
+                            checkHead(bytes(body[:headBytes]))
+                            checked = True
+                        if time.monotonic() - started > self.deadline:
+                            raise UpstreamError(f"{host} took longer than {self.deadline:g}s to respond")
+                    if not checked:
+                        checkHead(bytes(body))
+                    s.set(bytes=len(body))
+                    return bytes(body)
+            except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+                raise UpstreamError(f"{host} is not responding ({type(e).__name__})", retryable=True) from e
+            except requests.RequestException as e:
+                raise UpstreamError(f"Request to {host} failed ({type(e).__name__})") from e